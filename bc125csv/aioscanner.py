@@ -0,0 +1,127 @@
+"""
+Asyncio transport for the scanner, requires Python 3.5 or later.
+"""
+
+import sys
+import asyncio
+
+from bc125csv.scanner import ChannelTable, Scanner, ScannerException
+
+
+class AsyncScanner(object):
+    """
+    Scanner protocol on top of asyncio streams.
+
+    Commands are sent one at a time. Every command has a timeout, after
+    which ScannerException is raised. Responses to commands that timed
+    out or were cancelled are discarded before the next command is sent.
+    """
+
+    def __init__(self, reader, writer, timeout=2.0):
+        self.reader = reader
+        self.writer = writer
+        self.timeout = timeout
+        self.lock = asyncio.Lock()
+        # Responses still expected for abandoned commands
+        self.orphans = 0
+        # Known channel contents by index, None for empty channels
+        self.state = ChannelTable()
+
+    @classmethod
+    async def open(cls, port, baudrate=9600, **kwargs): # pragma: no cover
+        """Open a serial port using pyserial-asyncio."""
+        try:
+            import serial_asyncio
+        except ImportError:
+            sys.exit("Failed to import pyserial-asyncio "
+                "(https://pyserial-asyncio.readthedocs.io/), install using:\n"
+                "  pip install pyserial-asyncio")
+
+        reader, writer = await serial_asyncio.open_serial_connection(
+            url=port, baudrate=baudrate)
+        return cls(reader, writer, **kwargs)
+
+    def close(self):
+        self.writer.close()
+
+    async def readlinecr(self, timeout):
+        line = await asyncio.wait_for(self.reader.readuntil(b"\r"), timeout)
+        return line[:-1].decode()
+
+    async def discard_orphans(self, timeout):
+        """Read responses to abandoned commands, if they still arrive."""
+        while self.orphans:
+            try:
+                await self.readlinecr(timeout)
+            except asyncio.TimeoutError:
+                # Response got lost
+                pass
+            self.orphans -= 1
+
+    async def writeread(self, command, timeout=None):
+        timeout = timeout or self.timeout
+        async with self.lock:
+            await self.discard_orphans(timeout)
+
+            try:
+                self.writer.write((command + "\r").encode())
+                # Wait for the transport buffer to drain
+                await asyncio.wait_for(self.writer.drain(), timeout)
+                return await self.readlinecr(timeout)
+            except asyncio.TimeoutError:
+                self.orphans += 1
+                raise ScannerException("No response to %s." % command)
+            except asyncio.CancelledError:
+                self.orphans += 1
+                raise
+
+    async def send(self, command, timeout=None):
+        return Scanner.check_response(await self.writeread(command, timeout))
+
+    async def enter_programming(self):
+        result = await self.send("PRG")
+        if not result or result != "PRG,OK":
+            raise ScannerException("Failed to enter programming mode.")
+
+    async def exit_programming(self):
+        result = await self.send("EPG")
+        if not result or result != "EPG,OK":
+            raise ScannerException("Failed to leave programming mode.")
+
+    async def get_model(self):
+        """Get model name from scanner."""
+        result = await self.send("MDL")
+        if not result or not result.startswith("MDL,"):
+            raise ScannerException("Could not get model name.")
+        return result[4:]
+
+    async def get_channel(self, index, timeout=None):
+        """Read channel object from scanner."""
+        result = await self.send("CIN,%d" % index, timeout)
+        channel = Scanner.parse_channel(index, result)
+        self.state[index] = channel
+        return channel
+
+    async def set_channel(self, channel, timeout=None):
+        """Write channel object to scanner."""
+        result = await self.send(Scanner.format_channel(channel), timeout)
+        if not result or result != "CIN,OK":
+            raise ScannerException("Could not write to channel %d." % channel.index)
+        self.state[channel.index] = Scanner.stored_channel(channel)
+
+    async def delete_channel(self, index, revalidate=False, timeout=None):
+        """Delete channel from scanner.
+
+        The known channel state is trusted unless revalidate is set.
+        """
+        if revalidate or index not in self.state:
+            channel = await self.get_channel(index, timeout)
+        else:
+            channel = self.state[index]
+
+        # Only delete if channel has data
+        if channel:
+            result = await self.send("DCH,%d" % index, timeout)
+            if not result or result != "DCH,OK":
+                raise ScannerException("Could not delete channel %d." % index)
+            self.state[index] = None
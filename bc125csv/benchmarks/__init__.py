@@ -0,0 +1,204 @@
+"""
+Benchmarks for the protocol, parse and csv paths.
+
+Run using python -m bc125csv.benchmarks, see --help for options.
+Results are written as JSON to allow tracking them over releases.
+"""
+
+from __future__ import print_function
+from __future__ import division
+
+import os
+import time
+import shutil
+import platform
+import tempfile
+
+try:
+    # Python 2
+    from StringIO import StringIO
+except ImportError:
+    # Python 3
+    from io import StringIO
+
+from bc125csv import __version__
+from bc125csv.handler import Handler
+from bc125csv.importer import Importer
+from bc125csv.exporter import Exporter
+from bc125csv.scanner import Channel, Scanner, ScannerException
+from bc125csv.benchmarks.scanner import LatencyScanner
+
+
+# Channel rows, cycling through CTCSS/DCS notations
+CSV_ROW = "%d,%s,%d.%04d,FM,%s,2,no,no\n"
+CSV_TQ = ("none", "114.8 Hz", "DCS 026", "no tone", "CTCSS 67.0", "search")
+
+
+def create_csv(indexes=range(1, 501), name="Channel %d"):
+    """Create csv data with a channel for every index."""
+    lines = ["Channel,Name,Frequency,Modulation,CTCSS/DCS,Delay,Lockout,Priority\n"]
+    for index in indexes:
+        lines.append(CSV_ROW % (index, name % index, 150 + index // 100,
+            index % 100 * 100, CSV_TQ[index % len(CSV_TQ)]))
+    return "".join(lines)
+
+
+def create_channels(**kwargs):
+    return Importer(StringIO(create_csv(**kwargs))).read()
+
+
+def create_responses(**kwargs):
+    """Create CIN responses for the channels of create_channels."""
+    return [(index, Scanner.format_channel(channel))
+        for index, channel in create_channels(**kwargs).items()]
+
+
+def parse_channel_regex(index, result):
+    """Convert a CIN response to a channel object using RE_CIN.
+
+    Reference for Scanner.parse_channel, which checks the same format.
+    """
+    if not result:
+        raise ScannerException("Could not read channel %d." % index)
+
+    match = Scanner.RE_CIN.match(result)
+    if not match:
+        raise ScannerException("Unexpected data for channel %d." %  index)
+    data = match.groupdict()
+
+    frequency = int(data["freq"])
+    if not frequency:
+        return
+
+    return Channel(**{
+        "index":      int(data["index"]),
+        "name":       data["name"].strip(),
+        "frequency":  frequency,
+        "modulation": data["modulation"],
+        "tqcode":     int(data["tq"]),
+        "delay":      int(data["delay"]),
+        "lockout":    data["lockout"] == "1",
+        "priority":   data["priority"] == "1",
+    })
+
+
+class Benchmarks(object):
+    """
+    Collection of benchmarks sharing the simulated scanner settings.
+    """
+
+    def __init__(self, baudrate=115200, latency=0.002, jitter=0.0005,
+            process=0.001, repeat=3, changed=10):
+        self.settings = {
+            "baudrate": baudrate,
+            "latency": latency,
+            "jitter": jitter,
+            "process": process,
+        }
+        self.repeat = repeat
+        self.changed = changed
+
+    def create_scanner(self):
+        return LatencyScanner(**self.settings)
+
+    def create_handler(self, *args):
+        handler = Handler(["-n"] + list(args))
+        handler.serial_number = "benchmark"
+        return handler
+
+    def bench_export(self):
+        """Export all channels."""
+        scanner = self.create_scanner()
+        handler = self.create_handler("export")
+        return lambda: handler.export_channels(scanner), 500
+
+    def bench_import(self):
+        """Import all channels."""
+        scanner = self.create_scanner()
+        handler = self.create_handler("import")
+        channels = create_channels()
+        return lambda: handler.import_channels(scanner, channels), 500
+
+    def bench_import_verify(self):
+        """Import all channels and read them back."""
+        scanner = self.create_scanner()
+        handler = self.create_handler("import", "--verify")
+        channels = create_channels()
+        return lambda: handler.import_channels(scanner, channels), 500
+
+    def bench_import_diff(self):
+        """Import all channels, of which only a few changed."""
+        scanner = self.create_scanner()
+        handler = self.create_handler("import", "--diff")
+        handler.import_channels(scanner, create_channels())
+        channels = create_channels(name="Changed %d",
+            indexes=range(1, self.changed + 1))
+        channels.update((index, channel) for index, channel
+            in create_channels().items() if index > self.changed)
+        return lambda: handler.import_channels(scanner, channels), 500
+
+    def bench_importer_read(self):
+        """Parse csv data of all channels."""
+        data = create_csv()
+        return lambda: Importer(StringIO(data)).read(), 500
+
+    def bench_exporter_write(self):
+        """Write csv data of all channels."""
+        channels = create_channels()
+        return lambda: Exporter(StringIO()).write(channels), 500
+
+    def bench_parse_channel(self):
+        """Parse CIN responses of all channels."""
+        responses = create_responses()
+        return lambda: [Scanner.parse_channel(index, result)
+            for index, result in responses], 500
+
+    def bench_parse_channel_regex(self):
+        """Parse CIN responses of all channels using RE_CIN."""
+        responses = create_responses()
+        return lambda: [parse_channel_regex(index, result)
+            for index, result in responses], 500
+
+    def names(self):
+        return sorted(name[6:] for name in dir(self) if name.startswith("bench_"))
+
+    def run(self, names=None):
+        """Run benchmarks and return results."""
+        results = {}
+
+        # Keep the channel cache out of the home directory
+        cachedir = tempfile.mkdtemp()
+        environ = os.environ.copy()
+        os.environ["XDG_CACHE_HOME"] = cachedir
+
+        try:
+            for name in names or self.names():
+                results[name] = self.measure(getattr(self, "bench_" + name))
+        finally:
+            os.environ.clear()
+            os.environ.update(environ)
+            shutil.rmtree(cachedir)
+
+        return {
+            "version": __version__,
+            "python": platform.python_version(),
+            "settings": dict(self.settings, repeat=self.repeat,
+                changed=self.changed),
+            "results": results,
+        }
+
+    def measure(self, bench):
+        """Time a benchmark, which returns a function and its item count."""
+        timings = []
+        for _ in range(self.repeat):
+            fn, items = bench()
+            start = time.time()
+            fn()
+            timings.append(time.time() - start)
+
+        return {
+            "min": min(timings),
+            "mean": sum(timings) / len(timings),
+            "items": items,
+            "items_per_second": items / min(timings) if min(timings) else None,
+        }
@@ -0,0 +1,48 @@
+from __future__ import print_function
+
+import sys
+import json
+import argparse
+
+from bc125csv.benchmarks import Benchmarks
+
+
+def main(args=None):
+    """Run benchmarks and output JSON results."""
+    names = Benchmarks().names()
+
+    parser = argparse.ArgumentParser(prog="python -m bc125csv.benchmarks",
+        description="Benchmark bc125csv using a simulated scanner.")
+    parser.add_argument("names", nargs="*", metavar="BENCHMARK",
+        help="benchmarks to run: " + ", ".join(names))
+    parser.add_argument("-b", "--baudrate", type=int, default=115200,
+        help="simulated baud rate (default 115200)")
+    parser.add_argument("-l", "--latency", type=float, default=0.002,
+        help="simulated round trip seconds per command (default 0.002)")
+    parser.add_argument("-j", "--jitter", type=float, default=0.0005,
+        help="maximum random seconds added to latency (default 0.0005)")
+    parser.add_argument("-p", "--process", type=float, default=0.001,
+        help="simulated processing seconds per command (default 0.001)")
+    parser.add_argument("-r", "--repeat", type=int, default=3,
+        help="number of runs per benchmark (default 3)")
+    parser.add_argument("-o", "--output", help="write results to file")
+    params = parser.parse_args(args)
+
+    for name in params.names:
+        if name not in names:
+            parser.error("unknown benchmark: %s" % name)
+
+    benchmarks = Benchmarks(baudrate=params.baudrate, latency=params.latency,
+        jitter=params.jitter, process=params.process, repeat=params.repeat)
+    results = benchmarks.run(params.names)
+
+    if params.output:
+        with open(params.output, "w") as fh:
+            json.dump(results, fh, indent=2, sort_keys=True)
+    else:
+        json.dump(results, sys.stdout, indent=2, sort_keys=True)
+        print()
+
+
+if __name__ == "__main__":
+    main()
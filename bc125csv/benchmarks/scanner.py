@@ -0,0 +1,51 @@
+import time
+import random
+
+from bc125csv.scanner import VirtualScanner
+
+
+class LatencyScanner(VirtualScanner):
+    """
+    Virtual scanner simulating the timing of a serial connection.
+
+    Commands travel at the given baud rate and take latency seconds
+    (plus up to jitter seconds) to reach the scanner and back. The
+    scanner handles one command at a time, taking process seconds each,
+    so pipelined commands only save on the latency.
+    """
+
+    def __init__(self, baudrate=115200, latency=0.002, jitter=0.0005,
+            process=0.001, seed=0):
+        super(LatencyScanner, self).__init__()
+        self.rate = baudrate
+        self.latency = latency
+        self.jitter = jitter
+        self.process = process
+        self.random = random.Random(seed)
+        # Time at which the scanner finished the last command
+        self.busy = 0.0
+
+    def transfer(self, data):
+        """Seconds needed to send data, using 10 bits per byte (8N1)."""
+        return (len(data) + 1) * 10.0 / self.rate
+
+    def delay(self):
+        return (self.latency + self.random.uniform(0, self.jitter)) / 2
+
+    def writecommand(self, command):
+        arrival = time.time() + self.transfer(command) + self.delay()
+        response = super(LatencyScanner, self).writeread(command)
+        self.busy = max(arrival, self.busy) + self.process
+        ready = self.busy + self.transfer(response) + self.delay()
+        self.responses.append((ready, response))
+
+    def readlinecr(self):
+        ready, response = self.responses.popleft()
+        wait = ready - time.time()
+        if wait > 0:
+            time.sleep(wait)
+        return response
+
+    def writeread(self, command):
+        self.writecommand(command)
+        return self.readlinecr()
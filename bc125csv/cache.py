@@ -0,0 +1,219 @@
+import os
+import re
+import errno
+import tempfile
+import threading
+
+from bc125csv.scanner import ChannelTable, Scanner, ScannerException
+
+
+def get_cache_dir():
+    """Directory for files kept between sessions."""
+    base = os.environ.get("XDG_CACHE_HOME") or \
+        os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "bc125csv")
+
+
+def replace_file(filename, data, mode=None):
+    """
+    Write data to a file at once, creating its directory if needed.
+    The file is only readable by the user, unless a mode is given,
+    which the umask applies to like for new files.
+    """
+    directory = os.path.dirname(filename) or "."
+    try:
+        os.makedirs(directory)
+    except OSError as err:
+        if err.errno != errno.EEXIST:
+            raise
+
+    fd, tempname = tempfile.mkstemp(dir=directory)
+    with os.fdopen(fd, "w") as fh:
+        fh.write(data)
+    if mode is not None:
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(tempname, mode & ~umask)
+    os.rename(tempname, filename)
+
+
+def parse_lines(lines):
+    """Read channels from lines, None for DCH lines of empty channels."""
+    channels = ChannelTable()
+    for line in lines:
+        line = line.rstrip("\r\n")
+        try:
+            command, index = line.split(",", 2)[:2]
+            index = int(index)
+            if command == "DCH":
+                channels[index] = None
+            elif command == "CIN":
+                channels[index] = Scanner.parse_channel(index, line)
+        except (ValueError, ScannerException):
+            # Skip damaged lines
+            continue
+    return channels
+
+
+def format_line(index, channel):
+    """Line for a channel in CIN write format, or DCH if it is empty."""
+    if channel:
+        return Scanner.format_channel(channel) + "\n"
+    return "DCH,%d\n" % index
+
+
+class ChannelCache(object):
+    """
+    Persist the known channels of a scanner between sessions.
+
+    Every scanner has its own cache file, named after its identity.
+    Each line holds a channel in CIN write format, or a DCH command
+    for an empty channel.
+    """
+
+    def __init__(self, identity, directory=None):
+        self.identity = identity
+        self.directory = directory or get_cache_dir()
+        self.filename = os.path.join(self.directory,
+            re.sub(r"[^A-Za-z0-9.-]+", "_", identity) + ".channels")
+
+    def load(self):
+        """Read cached channels, None for empty channels."""
+        try:
+            fh = open(self.filename, "r")
+        except IOError:
+            return ChannelTable()
+
+        with fh:
+            return parse_lines(fh)
+
+    def save(self, channels):
+        """Write channels to the cache, keeping other cached channels."""
+        cached = self.load()
+        cached.update(channels)
+
+        replace_file(self.filename, "".join(format_line(index, channel)
+            for index, channel in cached.items()))
+
+
+class Journal(object):
+    """
+    Channels confirmed on the scanner during an import or export.
+
+    Channels are appended in batches as they are written, deleted or
+    read, so an interrupted run can resume where it stopped. The first
+    line holds the identity of the scanner, a journal of another
+    scanner is started over.
+    """
+
+    # Channels per batch
+    BATCH = 25
+
+    def __init__(self, filename, identity):
+        self.filename = filename
+        self.identity = identity
+        # Channels confirmed by an interrupted run
+        self.channels = ChannelTable()
+        self.fh = None
+
+    def open(self):
+        """Load channels of an interrupted run and open for appending."""
+        try:
+            with open(self.filename, "r") as fh:
+                lines = fh.readlines()
+        except IOError:
+            lines = []
+
+        if lines and lines[0].rstrip("\r\n") == "# " + self.identity:
+            self.channels = parse_lines(lines[1:])
+            self.fh = open(self.filename, "a")
+            # Line cut off by the interruption
+            if not lines[-1].endswith("\n"):
+                self.fh.write("\n")
+        else:
+            self.fh = open(self.filename, "w")
+            self.fh.write("# %s\n" % self.identity)
+        self.fh.flush()
+
+        return self.channels
+
+    def record(self, channels):
+        """Append channels, as (index, channel) pairs, to the journal."""
+        for index, channel in channels:
+            self.fh.write(format_line(index, channel))
+        self.fh.flush()
+        os.fsync(self.fh.fileno())
+
+    def close(self):
+        self.fh.close()
+
+    def remove(self):
+        """Remove the journal of a completed run."""
+        self.close()
+        os.unlink(self.filename)
+
+
+class DeviceCache(object):
+    """
+    Remember the device path of the last scanner found.
+    """
+
+    def __init__(self, directory=None):
+        self.directory = directory or get_cache_dir()
+        self.filename = os.path.join(self.directory, "device")
+
+    def load(self):
+        """Read the remembered device path, if any."""
+        try:
+            with open(self.filename, "r") as fh:
+                return fh.read().strip() or None
+        except IOError:
+            return None
+
+    def save(self, path):
+        replace_file(self.filename, path + "\n")
+
+
+class RateCache(object):
+    """
+    Remember the baud rate found for each device between sessions.
+
+    All devices share one file, with a device and its rate per line.
+    """
+
+    # Devices used at once save their rates from separate threads
+    lock = threading.Lock()
+
+    def __init__(self, directory=None):
+        self.directory = directory or get_cache_dir()
+        self.filename = os.path.join(self.directory, "rates")
+
+    def load(self):
+        """Read remembered rates by device."""
+        rates = {}
+        try:
+            fh = open(self.filename, "r")
+        except IOError:
+            return rates
+
+        with fh:
+            for line in fh:
+                try:
+                    device, rate = line.rstrip("\r\n").rsplit(" ", 1)
+                    rates[device] = int(rate)
+                except ValueError:
+                    # Skip damaged lines
+                    continue
+
+        return rates
+
+    def get(self, device):
+        return self.load().get(device)
+
+    def save(self, device, rate):
+        """Remember the rate of a device, keeping other devices."""
+        with self.lock:
+            rates = self.load()
+            rates[device] = rate
+            replace_file(self.filename, "".join("%s %d\n" % item
+                for item in sorted(rates.items())))
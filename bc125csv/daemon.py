@@ -0,0 +1,140 @@
+"""
+Daemon holding the scanner open, serving commands over a Unix socket.
+
+Every request is a line of JSON with the command line arguments, the
+input and working directory of the client. The response is a line of
+JSON with the output and error output of the command, and its exit
+code if it exited.
+"""
+
+import os
+import sys
+import json
+import socket
+
+try:
+    # Python 2
+    import SocketServer as socketserver
+    from StringIO import StringIO
+except ImportError:
+    # Python 3
+    import socketserver
+    from io import StringIO
+
+from bc125csv.cache import get_cache_dir
+from bc125csv.scanner import ScannerException
+
+
+def get_socket_path():
+    """Default socket path, in the runtime directory if there is one."""
+    path = os.environ.get("BC125CSV_SOCKET")
+    if path:
+        return path
+    directory = os.environ.get("XDG_RUNTIME_DIR") or get_cache_dir()
+    return os.path.join(directory, "bc125csv.sock")
+
+
+def is_running(path):
+    """A daemon is listening on the socket."""
+    try:
+        Client(path).close()
+    except EnvironmentError:
+        return False
+    return True
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        line = self.rfile.readline()
+        try:
+            request = json.loads(line.decode())
+        except ValueError:
+            # Connection closed without request
+            return
+
+        response = self.server.run_request(request)
+        self.wfile.write((json.dumps(response) + "\n").encode())
+
+
+class ScannerServer(socketserver.UnixStreamServer):
+    """
+    Run commands received on a Unix socket, one at a time.
+
+    The run function is called with the command line arguments, while
+    the standard streams are redirected and the working directory is
+    changed to those of the client.
+    """
+
+    def __init__(self, path, run):
+        self.path = path
+        self.run = run
+        # Only the owner may use the scanner, from the moment the socket
+        # is created
+        umask = os.umask(0o177)
+        try:
+            socketserver.UnixStreamServer.__init__(self, path, RequestHandler)
+        finally:
+            os.umask(umask)
+
+    def run_request(self, request):
+        streams = sys.stdin, sys.stdout, sys.stderr
+        sys.stdin = StringIO(request.get("stdin", ""))
+        sys.stdout, sys.stderr = StringIO(), StringIO()
+        cwd = os.getcwd()
+        response = {}
+
+        try:
+            os.chdir(request.get("cwd") or cwd)
+            self.run(request.get("args", []))
+        except SystemExit as err:
+            response["code"] = err.code
+        except ScannerException as err:
+            response["code"] = str(err)
+        except Exception as err:
+            # Answer the client instead of dropping the connection
+            response["code"] = "%s: %s" % (type(err).__name__, err)
+        finally:
+            os.chdir(cwd)
+            response["stdout"] = sys.stdout.getvalue()
+            response["stderr"] = sys.stderr.getvalue()
+            sys.stdin, sys.stdout, sys.stderr = streams
+
+        return response
+
+    def server_close(self):
+        socketserver.UnixStreamServer.server_close(self)
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+
+class Client(object):
+    """
+    Connection to a daemon for a single request.
+    """
+
+    def __init__(self, path):
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            self.socket.connect(path)
+        except EnvironmentError:
+            self.socket.close()
+            raise
+
+    def close(self):
+        self.socket.close()
+
+    def request(self, args, stdin=""):
+        """Run a command on the daemon and return its response."""
+        request = {"args": args, "stdin": stdin, "cwd": os.getcwd()}
+        try:
+            self.socket.sendall((json.dumps(request) + "\n").encode())
+            line = self.socket.makefile("rb").readline()
+        finally:
+            self.close()
+
+        try:
+            return json.loads(line.decode())
+        except ValueError:
+            raise ScannerException("No response from daemon.")
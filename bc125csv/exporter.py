@@ -2,6 +2,8 @@ from __future__ import print_function
 
 import csv
 
+from bc125csv.scanner import ChannelTable, format_frequency
+
 
 class Exporter(object):
     """
@@ -27,21 +29,17 @@ class Exporter(object):
         self.csvwriter.writerow(row or [])
 
     def write(self, channels):
+        if not isinstance(channels, ChannelTable):
+            channels = ChannelTable(channels)
+
         # Iterate over all banks
         for bank in range(1, 11):
-            bankheader = False
-            
-            for index in range(bank * 50 - 49, bank * 50 + 1):
-                if index not in channels:
-                    continue
-
-                if not bankheader:
-                    self.writerow()
-                    self.writerow(["# Bank %d" % bank])
-                    bankheader = True
-
-                channel = channels[index]
+            bankchannels = channels.bank(bank)
+            if bankchannels:
+                self.writerow()
+                self.writerow(["# Bank %d" % bank])
 
+            for index, channel in bankchannels:
                 if not channel:
                     self.writerow([index])
                     continue
@@ -63,7 +61,7 @@ class Exporter(object):
                 self.writerow([
                     channel.index,
                     channel.name,
-                    channel.frequency,
+                    format_frequency(channel.frequency),
                     channel.modulation,
                     "" if channel.tqcode == 0 and self.sparse else channel.tq,
                     channel.delay,
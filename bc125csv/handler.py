@@ -1,17 +1,31 @@
 from __future__ import print_function
 
 import os
+import re
 import sys
+import copy
+import glob
+import time
+import shlex
+import random
 import argparse
+import contextlib
+import threading
+import multiprocessing
 
 from bc125csv.scanner import (
+    ChannelTable,
     DeviceLookup,
     Scanner,
     ScannerException, 
     SUPPORTED_MODELS,
     VirtualScanner,
 )
-from bc125csv.importer import Importer
+from bc125csv import daemon
+from bc125csv.cache import ChannelCache, DeviceCache, Journal, RateCache
+from bc125csv.importer import Importer, ParseError
+from bc125csv.observer import PrometheusObserver
+from bc125csv.profiler import Profiler
 from bc125csv.exporter import Exporter
 
 VERSION = "bc125csv version 1.0.2 Released Apr 24, 2020"
@@ -25,24 +39,45 @@ America Corporation. This application and its author
 are not affiliated with or endorsed by Uniden in any way.
 
 Usage: %%(prog)s ACTION [OPTIONS]
+-a, --all-devices    Import or export on all connected scanners at once.
 -b, --banks BANKS    Only process given banks.
                      Separate multiple banks with spaces.
+-c, --cached         Use channels cached in a previous session.
+                     Implies --diff when importing.
+-d, --diff           Only write channels that differ when importing.
 -e, --include-empty  Include empty channels in export.
 -h, --help           Display this help and exit.
                      Use command help for detailed instructions.
 -i, --input FILE     Read from file when importing.
+                     Verify accepts wildcards, and -i more than once.
+-j, --jobs N         Verify multiple files using N processes.
 -n, --no-scanner     Use a virtual scanner device.
 -o, --output FILE    Write to file when exporting.
--r, --rate           Baud rate (default 9600).
+-r, --rate RATE      Baud rate (default 9600), or auto to use the
+                     fastest working rate.
 -s, --sparse         Omit 'no' and 'none' values in export.
 -v, --verbose        Be more verbose.
 -V, --version        Output version information and exit.
+--journal FILE       Keep track of progress to resume an interrupted
+                     import or export.
+--metrics FILE       Write counters of commands and operations to FILE
+                     in the Prometheus text format.
+--profile            Report command timings after an import or export.
+--profile-trace FILE Also write the timings to FILE as JSON.
+--retries N          Retry channel commands getting an error N times
+                     (default 3).
+--socket PATH        Socket of the daemon started by serve.
+--verify             Read back written channels after importing.
+--verify-sample N    With --cached, check N random cached channels
+                     against the scanner.
 
 Available actions are:
   verify  - Verify csv data (no device needed).
   import  - Import channels to the scanner in csv format.
   export  - Export channels from the scanner in csv format.
   shell   - Start an interactive shell with the device.
+  batch   - Run a script of import, export and verify steps.
+  serve   - Keep the device open for import, export and shell.
   help    - Display detailed help.
 
 Compatible scanners: %(models)s
@@ -86,7 +121,95 @@ The import format is the same as the export format, but forgiving:
  * lines beginning with a '#' (comment line) or ',' (no channel) and 
    the first line (containing the header) are ignored,
  * additional columns are ignored,
- * frequencies are automatically rounded down to 4 decimal places.
+ * frequencies are automatically rounded down to 4 decimal places,
+ * frequencies must be in the supported bands (25-54, 108-174, 225-380
+   and 400-512 MHz) and on one of their channel steps.
+
+
+CACHE
+
+The channels of each scanner are cached after every import and
+export using --cached or --journal. Use the --cached option to skip
+reading channels that are in the cache; add --verify-sample N to
+first compare N random cached channels with the scanner, and read all
+channels if any differ. Without --cached, --verify-sample has no
+effect. When importing, --cached only writes channels that differ
+from the cached channels.
+
+Use --verify to read back the written and deleted channels after an
+import and compare them with the imported channels. Only these
+channels are read again.
+
+Use --journal FILE to keep track of the channels written, deleted
+or read during an import or export. If the run is interrupted, run
+the same command with the same journal to resume: channels in the
+journal are not written or read again. The journal is removed when
+the run completes.
+
+With --rate auto, the supported baud rates are tried fastest first
+and the first rate at which the scanner answers cleanly is used. The
+rate is remembered for each device and probed again when it stops
+working.
+
+The last scanner found is remembered as well, it is used directly
+as long as its device is still present.
+
+
+METRICS
+
+Use --metrics FILE to count the commands sent to the scanner, the errors
+and retries among them and the bytes transferred, per command type, as
+well as the import, export, batch and programming operations, their
+failures and the seconds spent in them. FILE is replaced after every
+operation in the Prometheus text format, for the textfile collector of
+the node exporter. The counters of serve add up over all commands run.
+With --all-devices the counters are labelled by device, and FILE is
+written once all devices are done.
+
+
+PROFILE
+
+Use --profile to report the time taken by the commands sent during an
+import or export. For each type of command, the 50th, 95th and 99th
+percentile of the time from writing the command to receiving its last
+byte are shown in milliseconds, followed by the number of channels and
+bytes transferred per second. With --profile-trace FILE the timings of
+every command, including when it was written, flushed and its first
+and last byte received, are also written to FILE as JSON.
+
+
+RETRIES
+
+Channel reads, writes and deletes that get an error are retried up to
+3 times, or the number set using --retries, waiting longer before
+every next retry. At most 50 retries are made per programming session.
+Commands sent to the daemon and batch steps may set their own number,
+otherwise the one given to serve or batch is used.
+
+
+BATCH
+
+The batch action reads a script with a command line of an import,
+export or verify action on each line, and runs all of them in one
+programming session. Options for finding and opening the scanner are
+given to batch. Empty lines and comments starting with '#' are
+ignored. Steps can not use all devices. The batch stops at the first
+step that fails.
+
+# Backup, import and export the result for comparison
+export -o backup.csv
+import -d -i channels.csv
+export -o result.csv
+
+
+DAEMON
+
+The serve action opens the scanner once and keeps it open, along with
+its channel cache. While it runs, the import, export, shell and batch
+actions are sent to it over a Unix socket instead of opening the scanner
+themselves. Options for finding and opening the scanner, like --rate,
+are given to serve. The socket is $BC125CSV_SOCKET if set, otherwise
+bc125csv.sock in $XDG_RUNTIME_DIR, and can be changed using --socket.
 
 
 SHELL
@@ -116,20 +239,68 @@ Importing from csv file:
 Verify a csv file:
 %(prog)s verify -v -i channels.csv
 
+Verify all csv files in a directory using 4 processes:
+%(prog)s verify -j 4 -i "sites/*.csv"
+
+Importing only changed channels and reading them back:
+%(prog)s import -d --verify -i channels.csv
+
+Resuming an interrupted import:
+%(prog)s import --journal import.journal -i channels.csv
+
+Importing at the fastest working baud rate:
+%(prog)s import --rate auto -i channels.csv
+
+Timing an export, writing the command timings to trace.json:
+%(prog)s export --profile-trace trace.json -o channels.csv
+
+Keeping the scanner open, counting commands for Prometheus:
+%(prog)s serve --metrics /var/lib/node_exporter/bc125csv.prom &
+
+Importing into all connected scanners:
+%(prog)s import -a -i channels.csv
+
+Exporting from all connected scanners to backup-SERIAL.csv:
+%(prog)s export -a -o backup.csv
+
+Running the steps in script.txt in one programming session:
+%(prog)s batch -i script.txt
+
+Keeping the scanner open for multiple commands:
+%(prog)s serve -r auto &
+%(prog)s export -b 1 > bank-1.csv
+
 Enable backlight using the shell:
 echo -en "PRG\\nBLT,AO\\nEPG" | %(prog)s shell
 """
 
 
+# Retries of channel commands, unless set using --retries
+RETRIES = 3
+
+
 class Handler(object):
     """
     Handle a command call.
 
     Arguments are taken from sys.stdin unless a list of arguments is given.
+    An observer, if given, is notified of the commands and operations.
     """
-    def __init__(self, args=None):
+    def __init__(self, args=None, observer=None):
         self.parser = self.create_parser()
         self.params = self.parser.parse_args(args)
+        self.args = sys.argv[1:] if args is None else list(args)
+        # Device to use instead of looking for one
+        self.device = None
+        # Open scanner and its cache, when run by the daemon
+        self.scanner = None
+        self.cache = None
+        # Journal of the current import or export
+        self.journal = None
+        # Observer of the commands and operations, if any
+        self.observer = observer
+        if not observer and self.params.metrics:
+            self.observer = PrometheusObserver(self.params.metrics)
 
 
     def create_parser(self):
@@ -143,23 +314,40 @@ class Handler(object):
         # Parse arguments passed by user
         parser = argparse.ArgumentParser(formatter_class=Usage)
         parser.add_argument("command", nargs="?", 
-            choices=("verify", "import", "export", "shell", "help"))
+            choices=("verify", "import", "export", "shell", "batch", "serve",
+                "help"))
+        parser.add_argument("-a", "--all-devices", action="store_true", 
+            dest="all")
         parser.add_argument("-b", "--banks", type=int, dest="banks", nargs="+",
             choices=range(1,11), default=range(1,11))
+        parser.add_argument("-c", "--cached", action="store_true", 
+            dest="cached")
+        parser.add_argument("-d", "--diff", action="store_true", dest="diff")
         parser.add_argument("-e", "--include-empty", action="store_true", 
             dest="empty")
-        parser.add_argument("-i", "--input", dest="input")
+        parser.add_argument("-i", "--input", dest="input", action="append")
+        parser.add_argument("-j", "--jobs", type=int, dest="jobs",
+            default=multiprocessing.cpu_count())
         parser.add_argument("-n", "--no-scanner", action="store_true", 
             dest="noscanner")
         parser.add_argument("-o", "--output", dest="output")
-        parser.add_argument("-r", "--rate", type=int, dest="rate",
-            choices=(4800, 9600, 19200, 38400, 57600, 115200), default=9600)
+        parser.add_argument("-r", "--rate", type=baud_rate, dest="rate",
+            choices=("auto",) + Scanner.RATES, default=9600)
         parser.add_argument("-s", "--sparse", action="store_true", 
             dest="sparse")
         parser.add_argument("-v", "--verbose", action="store_true", 
             dest="verbose")
         parser.add_argument("-V", "--version", action="store_true", 
             dest="version")
+        parser.add_argument("--journal", dest="journal")
+        parser.add_argument("--metrics", dest="metrics")
+        parser.add_argument("--profile", action="store_true", dest="profile")
+        parser.add_argument("--profile-trace", dest="trace")
+        parser.add_argument("--retries", type=int, dest="retries")
+        parser.add_argument("--socket", dest="socket")
+        parser.add_argument("--verify", action="store_true", dest="verify")
+        parser.add_argument("--verify-sample", type=int, dest="sample",
+            default=0)
 
         return parser
 
@@ -178,9 +366,23 @@ class Handler(object):
         if self.params.command == "verify":
             return self.command_verify()
         
+        if self.params.command == "serve":
+            return self.command_serve()
+
+        if self.params.command in ("import", "export") and self.params.all:
+            return self.command_all()
+
+        if self.params.command in ("import", "export", "shell", "batch"):
+            client = self.get_client()
+            if client:
+                return self.command_remote(client)
+
         if self.params.command == "shell":
             return self.command_shell()
-        
+
+        if self.params.command == "batch":
+            return self.command_batch()
+
         if self.params.command == "import":
             return self.command_import()
 
@@ -188,18 +390,44 @@ class Handler(object):
             return self.command_export()
 
 
+    def get_devices(self):
+        """Find all compatible scanners with a serial tty."""
+        if self.params.noscanner:
+            return [{"DEVNAME": "virtual"}]
+
+        else: # pragma: no cover
+            self.print_verbose("Searching for compatible devices...")
+
+            lookup = DeviceLookup()
+            devices = lookup.get_devices()
+
+            for device in devices:
+                if not lookup.is_tty(device):
+                    print("Skipping compatible scanner without serial tty.",
+                        file=sys.stderr)
+
+            return [device for device in devices if lookup.is_tty(device)]
+
+
     def get_scanner(self):
+        # Scanner held open by the daemon
+        if self.scanner:
+            return self.scanner
+
         # Virtual scanner requested
         if self.params.noscanner:
             self.print_verbose("Using virtual scanner device.")
-            return VirtualScanner()
+            self.serial_number = self.device.get("DEVNAME") if self.device \
+                else "virtual"
+            scanner = VirtualScanner()
+            scanner.retries = self.get_retries()
+            if self.params.rate == "auto":
+                self.select_rate(scanner)
+            return scanner
 
         else: # pragma: no cover
-            # Look for a compatible device
-            self.print_verbose("Searching for compatible devices...")
-
             lookup = DeviceLookup()
-            device = lookup.get_device()
+            device = self.device or self.find_device(lookup)
 
             if not device:
                 sys.exit("No compatible scanner was found.")
@@ -214,7 +442,14 @@ class Handler(object):
             if not os.access(device.get("DEVNAME", ""), os.W_OK):
                 sys.exit("Found a compatible scanner, but can not write to it.")
 
-            scanner = Scanner(device.get("DEVNAME"), self.params.rate)
+            self.serial_number = device.get("ID_SERIAL_SHORT") or \
+                device.get("DEVNAME")
+            if self.params.rate == "auto":
+                scanner = Scanner(device.get("DEVNAME"))
+                self.select_rate(scanner)
+            else:
+                scanner = Scanner(device.get("DEVNAME"), self.params.rate)
+            scanner.retries = self.get_retries()
 
             try:
                 model = scanner.get_model()
@@ -227,12 +462,107 @@ class Handler(object):
             return scanner
 
 
+    def get_retries(self):
+        """Number of retries of channel commands."""
+        if self.params.retries is None:
+            return RETRIES
+        return self.params.retries
+
+
+    def find_device(self, lookup):
+        """Find a compatible device, trying the last one found first."""
+        cache = DeviceCache()
+        path = cache.load()
+        device = lookup.get_device_by_path(path) if path else None
+        if device:
+            self.print_verbose("Using device", path)
+            return device
+
+        self.print_verbose("Searching for compatible devices...")
+        device = lookup.get_device()
+        if device and lookup.is_tty(device):
+            cache.save(device.get("DEVNAME"))
+        return device
+
+
+    def select_rate(self, scanner):
+        """Switch to the remembered baud rate, or probe for the fastest.
+
+        Rates at which the scanner does not answer time out after a
+        second, the timeout of the scanner is restored afterwards.
+        """
+        rates = RateCache()
+        rate = rates.get(self.serial_number)
+        timeout, scanner.timeout = scanner.timeout, 1
+
+        try:
+            if rate:
+                scanner.set_rate(rate)
+                try:
+                    scanner.get_model()
+                except ScannerException:
+                    self.print_verbose("Remembered baud rate", rate, "failed")
+                    rate = None
+
+            if not rate:
+                self.print_verbose("Probing baud rates...")
+                try:
+                    rate = scanner.probe_rate()
+                except ScannerException:
+                    sys.exit("Could not find a working baud rate.\n"
+                        "Please try again or reconnect your device.")
+                rates.save(self.serial_number, rate)
+        finally:
+            scanner.timeout = timeout
+
+        self.print_verbose("Using baud rate", rate)
+
+
+    def load_cache(self, scanner):
+        """Get the channel cache for the scanner, if it is used.
+
+        The cache is only used with --cached or --journal, cached
+        channels are loaded into the scanner state with --cached.
+        """
+        if not (self.params.cached or self.params.journal):
+            return None
+
+        cache = self.cache
+        if not cache:
+            try:
+                identity = "-".join((scanner.get_model(),
+                    scanner.get_version(), self.serial_number))
+            except ScannerException:
+                sys.exit("Could not identify scanner for the channel cache.")
+            cache = ChannelCache(identity)
+
+        if self.params.cached:
+            self.print_verbose("Loading cached channels")
+            scanner.state.update(cache.load())
+        return cache
+
+
+    def get_input_files(self):
+        """Input file names with wildcards expanded, - for stdin."""
+        filenames = []
+        for pattern in self.params.input or ["-"]:
+            # Keep patterns without matches to report them as missing
+            matches = glob.glob(pattern) if re.search(r"[*?[]", pattern) \
+                else []
+            filenames.extend(sorted(matches) or [pattern])
+        return filenames
+
+
     def get_input_handle(self):
+        filenames = self.get_input_files()
+        if len(filenames) > 1:
+            sys.exit("Only one input file can be read.")
+
         # Read from file instead of stdin
-        if self.params.input and self.params.input != "-":
-            if not os.path.isfile(self.params.input):
+        if filenames[0] != "-":
+            if not os.path.isfile(filenames[0]):
                 sys.exit("Input file does not exist.")
-            return open(self.params.input, "r")
+            return open(filenames[0], "r")
         return sys.stdin
 
 
@@ -246,9 +576,18 @@ class Handler(object):
         return sys.stdout
 
 
+    def get_device_name(self, device):
+        """Short name of a device for reporting and file names."""
+        name = device.get("ID_SERIAL_SHORT") or \
+            os.path.basename(device.get("DEVNAME", ""))
+        return re.sub(r"[^A-Za-z0-9.-]+", "_", name)
+
+
     def print_verbose(self, *args):
         """Helper function: only print with raised verbosity level."""
         if self.params.verbose:
+            if self.device:
+                args = ("[%s]" % self.get_device_name(self.device),) + args
             print(*args, file=sys.stderr)
 
 
@@ -271,17 +610,65 @@ class Handler(object):
 
 
     def command_verify(self):
+        filenames = self.get_input_files()
+        if len(filenames) > 1:
+            return self.verify_files(filenames)
+
         fh = self.get_input_handle()
         importer = Importer(fh)
-        channels = importer.read()
 
-        if channels is None:
+        # Only keep track of errors, not the channels
+        errors = 0
+        for channel in importer.iter_channels():
+            if isinstance(channel, ParseError):
+                importer.print_error(channel.line, channel)
+                errors += 1
+
+        if errors:
             sys.exit("\nThere are errors in your csv data.")
 
         self.print_verbose("No errors found.")
         sys.exit()
 
 
+    def verify_files(self, filenames):
+        """Verify multiple files in parallel and report per file."""
+        for filename in filenames:
+            if not os.path.isfile(filename):
+                sys.exit("Input file does not exist: %s" % filename)
+
+        start = time.time()
+        if self.params.jobs > 1:
+            pool = multiprocessing.Pool(min(self.params.jobs, len(filenames)))
+            try:
+                results = pool.map(verify_file, filenames)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = list(map(verify_file, filenames))
+        elapsed = time.time() - start
+
+        for filename, (_, errors, _) in zip(filenames, results):
+            for line, err in errors:
+                where = " on line %d" % line if line else ""
+                print("Error in %s%s: %s" % (filename, where, err),
+                    file=sys.stderr)
+
+        # Report
+        total = 0
+        for filename, (channels, errors, seconds) in zip(filenames, results):
+            print("%s: %d channels, %d errors (%.2fs)" % (filename,
+                channels, len(errors), seconds), file=sys.stderr)
+            total += len(errors)
+        print("Verified %d files in %.2fs: %d errors." % (len(filenames),
+            elapsed, total), file=sys.stderr)
+
+        if total:
+            sys.exit("\nThere are errors in your csv data.")
+        sys.exit()
+
+
     def command_shell(self):
         scanner = self.get_scanner()
 
@@ -289,6 +676,11 @@ class Handler(object):
             print("Not all commands are emulated by the virtual scanner device.", 
                 file=sys.stderr)
 
+        self.run_shell(scanner.writeread)
+
+
+    def run_shell(self, writeread):
+        """Send commands from stdin using writeread and print responses."""
         # Commands piped into shell
         if not sys.stdin.isatty():
             for cmd in sys.stdin:
@@ -296,7 +688,7 @@ class Handler(object):
                 cmd = cmd.strip()
                 if not cmd:
                     continue
-                print(scanner.writeread(cmd))
+                print(writeread(cmd))
             sys.exit()
 
         # Enter interactive shell
@@ -312,14 +704,257 @@ class Handler(object):
                 cmd = get_input("> ")
             except (EOFError, KeyboardInterrupt):
                 break
-            print("<", scanner.writeread(cmd))
+            print("<", writeread(cmd))
 
         print("")
         sys.exit()
 
 
-    def command_import(self):
+    def use_scanner(self, scanner, cache, serial_number, observer=None):
+        """Use an open scanner and its cache instead of finding one.
+
+        The observer is used unless one was set for this command.
+        """
+        self.scanner = scanner
+        self.cache = cache
+        self.serial_number = serial_number
+        self.observer = self.observer or observer
+
+
+    def command_batch(self):
+        """Run import, export and verify steps in one programming session."""
+        fh = self.get_input_handle()
+
+        # Check all steps before using the scanner
+        steps = []
+        for number, line in enumerate(fh, 1):
+            args = shlex.split(line, comments=True)
+            if not args:
+                continue
+            try:
+                step = Handler(args)
+            except SystemExit:
+                sys.exit("Invalid step on line %d." % number)
+
+            # Options may come before the action
+            command = step.params.command
+            if command not in ("import", "export", "verify"):
+                sys.exit("Unsupported step on line %d: %s" % (number,
+                    command or args[0]))
+            # Steps share the scanner of the batch
+            if step.params.all:
+                sys.exit("Step on line %d can not use all devices." % number)
+
+            # The script itself is read from stdin
+            if fh is sys.stdin and command != "export" and \
+                    step.get_input_files() == ["-"]:
+                sys.exit("Step on line %d needs an input file." % number)
+            steps.append((number, step))
+
         scanner = self.get_scanner()
+        cache = self.load_cache(scanner)
+
+        with self.observing(scanner, "batch"), self.programming(scanner):
+            for number, step in steps:
+                self.print_verbose("Running line %d:" % number,
+                    " ".join(step.args))
+                step.use_scanner(scanner, cache, self.serial_number,
+                    self.observer)
+                try:
+                    with step.retrying(scanner):
+                        step.handle()
+                except SystemExit as err:
+                    # Verify exits when done
+                    if err.code:
+                        if not isinstance(err.code, int):
+                            print(err.code, file=sys.stderr)
+                        sys.exit("Batch failed on line %d." % number)
+
+
+    def get_client(self):
+        """Connect to the daemon if it is running.
+
+        Commands run by the daemon itself and commands using the virtual
+        scanner are not sent to the daemon.
+        """
+        if self.scanner or self.params.noscanner:
+            return None
+
+        path = self.params.socket or daemon.get_socket_path()
+        try:
+            return daemon.Client(path)
+        except EnvironmentError:
+            if self.params.socket:
+                sys.exit("Could not connect to daemon on %s." % path)
+
+
+    def command_remote(self, client):
+        """Run the command on the daemon and pass on its output."""
+        # Interactive shell sends every command on its own
+        if self.params.command == "shell" and sys.stdin.isatty():
+            client.close()
+            return self.run_shell(self.remote_writeread)
+
+        stdin = ""
+        if self.params.command == "shell" or (self.params.command in
+                ("import", "batch") and self.get_input_files() == ["-"]):
+            stdin = sys.stdin.read()
+
+        try:
+            response = client.request(self.args, stdin)
+        except ScannerException as err:
+            sys.exit(str(err))
+
+        sys.stdout.write(response["stdout"])
+        sys.stderr.write(response["stderr"])
+        if "code" in response:
+            sys.exit(response["code"])
+
+
+    def remote_writeread(self, command):
+        """Send a single command to the scanner held by the daemon."""
+        client = self.get_client()
+        if not client:
+            sys.exit("Lost connection to daemon.")
+        try:
+            response = client.request(["shell"], command + "\n")
+        except ScannerException as err:
+            sys.exit(str(err))
+        return response["stdout"].strip()
+
+
+    def command_serve(self):
+        """Keep the scanner open and run commands sent to the socket."""
+        path = self.params.socket or daemon.get_socket_path()
+        if daemon.is_running(path):
+            sys.exit("A daemon is already running on %s." % path)
+        if os.path.exists(path):
+            # Left behind by a daemon that did not stop cleanly
+            os.unlink(path)
+
+        scanner = self.get_scanner()
+        cache = self.load_cache(scanner)
+
+        def run(args):
+            handler = Handler(args)
+            if not handler.params.cached:
+                # Channels might have been changed on the keypad since
+                scanner.forget()
+            handler.use_scanner(scanner, cache, self.serial_number,
+                self.observer)
+            try:
+                with handler.retrying(scanner):
+                    handler.handle()
+            except ScannerException:
+                # Channels might have been written partially
+                scanner.forget()
+                raise
+
+        self.server = daemon.ScannerServer(path, run)
+        self.print_verbose("Listening on", path)
+        try:
+            self.server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.server.server_close()
+            scanner.close()
+
+
+    def get_indexes(self):
+        """Channel indexes in the selected banks."""
+        for bank in self.params.banks:
+            for index in range(bank * 50 - 49, bank * 50 + 1):
+                yield index
+
+
+    def read_channels(self, scanner):
+        """Read all channels in the selected banks from the scanner.
+
+        Empty channels are included with a value of None.
+        """
+        indexes = list(self.get_indexes())
+
+        # Spot check cached channels, read everything if any changed
+        if self.params.cached:
+            known = [index for index in indexes if index in scanner.state]
+            sample = random.sample(known, min(self.params.sample, len(known)))
+            if sample:
+                self.print_verbose("Verifying %d cached channels" % len(sample))
+                cached = [scanner.state[index] for index in sample]
+                if scanner.get_channels(sample) != cached:
+                    self.print_verbose("Cached channels are outdated")
+                    scanner.forget()
+        else:
+            scanner.forget()
+
+        if self.journal:
+            # Channels read before an interruption
+            scanner.state.update(self.journal.channels)
+
+        unknown = [index for index in indexes if index not in scanner.state]
+        for index in unknown:
+            self.print_verbose("Reading channel %d" % index)
+        for batch in self.get_batches(unknown):
+            scanner.get_channels(batch)
+            self.record(scanner, batch)
+
+        return ChannelTable((index, scanner.state[index]) for index in indexes)
+
+
+    def open_journal(self, cache):
+        """Open the journal if requested, loading an interrupted run."""
+        if not self.params.journal:
+            return None
+
+        journal = Journal(self.params.journal, cache.identity)
+        try:
+            channels = journal.open()
+        except IOError:
+            sys.exit("Could not open journal file.")
+
+        if channels:
+            self.print_verbose("Resuming with %d channels from the journal"
+                % len(channels))
+        return journal
+
+
+    @contextlib.contextmanager
+    def journaling(self, cache):
+        """Keep the journal open within the block, if requested.
+
+        The journal is removed when the block completes, and kept to
+        resume from when it fails.
+        """
+        self.journal = self.open_journal(cache)
+        if not self.journal:
+            yield
+            return
+
+        try:
+            yield
+        finally:
+            self.journal.close()
+        self.journal.remove()
+
+
+    def get_batches(self, items):
+        """Split items in batches to record in the journal."""
+        if not self.journal:
+            return [items] if items else []
+        size = self.journal.BATCH
+        return [items[start:start + size] for start in range(0, len(items), size)]
+
+
+    def record(self, scanner, indexes):
+        """Record the state of channels in the journal."""
+        if self.journal:
+            self.journal.record((index, scanner.state[index])
+                for index in indexes)
+
+
+    def read_import(self):
+        """Read channels to import from the input."""
         fh = self.get_input_handle()
 
         importer = Importer(fh)
@@ -328,56 +963,310 @@ class Handler(object):
         if channels is None:
             sys.exit("\nThere are errors in your csv data.")
 
+        return channels
+
+
+    @contextlib.contextmanager
+    def programming(self, scanner):
+        """Programming session on the scanner, reported when verbose."""
+        if scanner.sessions:
+            # Part of the current session
+            with scanner.programming():
+                yield
+            return
+
+        self.print_verbose("Entering programming mode")
+        with self.observing(scanner, "programming"), scanner.programming():
+            scanner.retried.clear()
+            try:
+                yield
+            finally:
+                self.print_retries(scanner)
+            self.print_verbose("Leaving programming mode")
+
+
+    @contextlib.contextmanager
+    def observing(self, scanner, name):
+        """Report an operation and its commands to the observer, if any.
+
+        Without scanner only the operation is reported.
+        """
+        if not self.observer:
+            yield
+            return
+
+        if scanner:
+            previous, scanner.observer = scanner.observer, self.observer
+        try:
+            with self.observer.span(name):
+                yield
+        finally:
+            if scanner:
+                scanner.observer = previous
+
+
+    @contextlib.contextmanager
+    def profiling(self, scanner):
+        """Time the commands sent to the scanner if requested."""
+        if not self.params.profile and not self.params.trace:
+            yield
+            return
+
+        profiler = scanner.profiler = Profiler()
+        try:
+            yield
+        finally:
+            scanner.profiler = None
+            print(profiler.report(), file=sys.stderr)
+            if self.params.trace:
+                with open(self.params.trace, "w") as fh:
+                    profiler.write_trace(fh)
+
+
+    @contextlib.contextmanager
+    def retrying(self, scanner):
+        """Use the retries set for this command on a shared scanner."""
+        if self.params.retries is None:
+            yield
+            return
+
+        retries = scanner.retries
+        scanner.retries = self.params.retries
+        try:
+            yield
+        finally:
+            scanner.retries = retries
+
+
+    def print_retries(self, scanner):
+        """Report the number of retried commands when verbose."""
+        if scanner.retried:
+            self.print_verbose("Retried", ", ".join("%s %d times" % item
+                for item in sorted(scanner.retried.items())))
+        if scanner.retry_budget <= 0:
+            self.print_verbose("Retry budget used up")
+
+
+    def import_channels(self, scanner, channels):
+        """Write channels in the selected banks to the scanner."""
         if scanner.get_model() == "UBC125XLT": # pragma: no cover
             if any(channel.modulation == "NFM" for channel in channels.values()):
                 sys.exit("NFM modulation is not supported on your device.")
 
-        self.print_verbose("Entering programming mode")
-        scanner.enter_programming()
+        cache = self.load_cache(scanner)
+        with self.journaling(cache), self.programming(scanner):
+            done = self.journal.channels if self.journal else ChannelTable()
+
+            # Snapshot the scanner to only write channels that changed
+            current = None
+            if self.params.diff or self.params.cached:
+                self.print_verbose("Reading current channels")
+                current = self.read_channels(scanner)
+
+            self.print_verbose("Importing into banks:", 
+                " ".join(map(str, self.params.banks)))
+
+            writes, deletes, unchanged, resumed = [], [], 0, 0
+            for index in self.get_indexes():
+                channel = channels.get(index)
+                # Compare as stored, with names cut by the scanner
+                stored = Scanner.stored_channel(channel)
+                if current is not None and current[index] == stored:
+                    unchanged += 1
+                    continue
 
-        self.print_verbose("Importing into banks:", 
-            " ".join(map(str, self.params.banks)))
+                # Written before an interruption
+                if index in done and done[index] == stored:
+                    resumed += 1
+                    continue
 
-        for bank in self.params.banks:
-            for index in range(bank * 50 - 49, bank * 50 + 1):
-                if index in channels:
-                    channel = channels[index]
+                if channel:
                     self.print_verbose("Writing channel %d" % index)
-                    scanner.set_channel(channel)
+                    writes.append(channel)
                 else:
                     self.print_verbose("Deleting channel %d" % index)
-                    scanner.delete_channel(index)
+                    deletes.append(index)
+
+            for batch in self.get_batches(writes):
+                scanner.set_channels(batch)
+                self.record(scanner, [channel.index for channel in batch])
+            for batch in self.get_batches(deletes):
+                scanner.delete_channels(batch)
+                self.record(scanner, batch)
+
+            if current is not None:
+                self.print_verbose("Skipped %d unchanged channels" % unchanged)
+            if resumed:
+                self.print_verbose("Skipped %d channels in the journal" % resumed)
+
+            failed = 0
+            if self.params.verify:
+                failed = self.verify_writes(scanner, writes, deletes)
+
+        if cache:
+            cache.save(scanner.state)
+
+        if failed:
+            sys.exit("Verification failed for %d channels." % failed)
+
+
+    def verify_writes(self, scanner, writes, deletes):
+        """Read back written and deleted channels and report differences.
+
+        Returns the number of channels that differ.
+        """
+        expected = ChannelTable((channel.index, Scanner.stored_channel(channel))
+            for channel in writes)
+        expected.update((index, None) for index in deletes)
+
+        self.print_verbose("Verifying %d channels" % len(expected))
+        indexes = list(expected.keys())
+        failed = 0
+        for index, channel in zip(indexes, scanner.get_channels(indexes)):
+            if channel != expected[index]:
+                print("Channel %d was not %s correctly." % (index,
+                    "written" if expected[index] else "deleted"),
+                    file=sys.stderr)
+                failed += 1
+        return failed
+
+
+    def export_channels(self, scanner):
+        """Read channels in the selected banks from the scanner."""
+        cache = self.load_cache(scanner)
+        with self.journaling(cache), self.programming(scanner):
+            self.print_verbose("Exporting banks:", 
+                " ".join(map(str, self.params.banks)))
+
+            # Get channels from device
+            channels = ChannelTable()
+            for index, channel in self.read_channels(scanner).items():
+                if channel or self.params.empty:
+                    channels[index] = channel
+
+        if cache:
+            cache.save(scanner.state)
+
+        return channels
 
-        self.print_verbose("Leaving programming mode")
-        scanner.exit_programming()
+
+    def command_import(self):
+        scanner = self.get_scanner()
+        channels = self.read_import()
+        with self.observing(scanner, "import"), self.profiling(scanner):
+            self.import_channels(scanner, channels)
 
 
     def command_export(self):
         scanner = self.get_scanner()
         fh = self.get_output_handle()
 
-        self.print_verbose("Entering programming mode")
-        scanner.enter_programming()
+        with self.observing(scanner, "export"), self.profiling(scanner):
+            channels = self.export_channels(scanner)
 
-        self.print_verbose("Exporting banks:", 
-            " ".join(map(str, self.params.banks)))
-
-        # Get channels from device
-        channels = {}
-        for bank in self.params.banks:
-            for index in range(bank * 50 - 49, bank * 50 + 1):
-                self.print_verbose("Reading channel %d" % index)
+        exporter = Exporter(fh, self.params.sparse)
+        exporter.write(channels)
 
-                channel = scanner.get_channel(index)
-                if channel or self.params.empty:
-                    channels[index] = channel
 
-        self.print_verbose("Leaving programming mode")
-        scanner.exit_programming()
+    def command_all(self):
+        """Import or export on all connected scanners in parallel."""
+        devices = self.get_devices()
+        if not devices:
+            sys.exit("No compatible scanner was found.")
 
-        exporter = Exporter(fh, self.params.sparse)
-        exporter.write(channels)
+        channels = None
+        if self.params.command == "import":
+            channels = self.read_import()
+        elif not self.params.output or self.params.output == "-":
+            sys.exit("Exporting from all devices requires an output file.")
+
+        # One handler per device, writing exports to separate files
+        workers = []
+        for device in devices:
+            worker = copy.copy(self)
+            worker.params = copy.copy(self.params)
+            worker.device = device
+            if self.observer:
+                worker.observer = self.observer.for_device(
+                    self.get_device_name(device))
+            for option in ("output", "journal", "trace"):
+                if getattr(self.params, option):
+                    base, ext = os.path.splitext(getattr(self.params, option))
+                    setattr(worker.params, option, "%s-%s%s" % (base,
+                        self.get_device_name(device), ext))
+            workers.append(worker)
+
+        errors = [None] * len(workers)
+
+        def run(number, worker):
+            try:
+                if channels is None:
+                    worker.command_export()
+                else:
+                    scanner = worker.get_scanner()
+                    with worker.observing(scanner, "import"), \
+                            worker.profiling(scanner):
+                        worker.import_channels(scanner, channels)
+            except ScannerException as err:
+                errors[number] = str(err)
+            except SystemExit as err:
+                if err.code:
+                    errors[number] = str(err.code)
+            except Exception as err:
+                # Serial port and file errors, programming mode was left
+                # by the programming session
+                errors[number] = str(err) or type(err).__name__
+
+        threads = [threading.Thread(target=run, args=item)
+            for item in enumerate(workers)]
+        # Metrics are written once all devices are done
+        with self.observing(None, "all devices"):
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        # Report results per device
+        for worker, error in zip(workers, errors):
+            name = self.get_device_name(worker.device)
+            if error is None:
+                worker.print_verbose("Done")
+            else:
+                print("%s: %s" % (name, error.strip()), file=sys.stderr)
+
+        if any(error is not None for error in errors):
+            sys.exit("Failed on %d of %d devices." % (
+                len([error for error in errors if error is not None]),
+                len(workers)))
+
+
+
+def baud_rate(value):
+    """Baud rate option value, a number or auto."""
+    return value if value == "auto" else int(value)
+
+
+def verify_file(filename):
+    """
+    Verify a csv file, used by processes verifying multiple files.
 
+    Returns the number of channels, a list of (line, error) pairs and
+    the number of seconds it took. A file that can not be read gives an
+    error without line.
+    """
+    start = time.time()
+    channels, errors = 0, []
+    try:
+        with open(filename, "r") as fh:
+            for channel in Importer(fh).iter_channels():
+                if isinstance(channel, ParseError):
+                    errors.append((channel.line, str(channel)))
+                else:
+                    channels += 1
+    except (EnvironmentError, UnicodeDecodeError) as err:
+        errors.append((None, "Could not read file: %s" %
+            (getattr(err, "strerror", None) or err)))
+    return channels, errors, time.time() - start
 
 
 def main(args=None):
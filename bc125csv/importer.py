@@ -3,13 +3,20 @@ from __future__ import print_function
 import re
 import csv
 import sys
-import string
 
-from bc125csv.scanner import CTCSS_TONES, DCS_CODES, Channel
+from bc125csv.scanner import (
+    CTCSS_LOOKUP,
+    DCS_LOOKUP,
+    TQ_CODES,
+    Channel,
+    ChannelTable,
+    is_supported_frequency,
+)
 
 
 class ParseError(Exception):
-    pass
+    """Invalid csv data, line is set for errors found while reading."""
+    line = None
 
 
 class Importer(object):
@@ -21,16 +28,35 @@ class Importer(object):
     RE_CTCSS = re.compile(r"^(?:ctcss)?\s*(\d{2,3}\.\d)\s*(?:hz)?$", re.I)
     RE_DCS = re.compile(r"^(?:dcs)?\s*(\d{2,3})$", re.I)
     RE_FREQ = re.compile(r"^(\d{1,4})(\s{0}\.\d+)?\s*(?:mhz)?$", re.I)
+    RE_NAME = re.compile(r"[A-Za-z0-9!@#$%&*()\-/<>.? ]*\Z")
+
+    # Valid values
+    MODULATIONS = frozenset(("FM", "AM", "AUTO", "NFM"))
+    DELAYS = dict((str(delay), delay) for delay in (-10, -5, 0, 1, 2, 3, 4, 5))
+    FLAGS = {"0": False, "no": False, "false": False,
+        "1": True, "yes": True, "true": True}
 
     def __init__(self, fh):
         self.csvreader = csv.reader(fh)
 
+        # Parsers for the columns, in order of the Channel arguments
+        self.parsers = (
+            self.parse_index,
+            self.parse_name,
+            self.parse_frequency,
+            self.parse_modulation,
+            self.parse_tqcode,
+            self.parse_delay,
+            self.parse_lockout,
+            self.parse_priority,
+        )
+
     def parse_index(self, value):
         """Parses a channel index."""
         if value is not None:
             try:
                 index = int(value)
-                if index in range(1, 501):
+                if 1 <= index <= 500:
                     return index
             except ValueError:
                 pass
@@ -40,23 +66,23 @@ class Importer(object):
         """Parses and validates a channel name."""
         if value is None:
             return ""
-        valid = string.ascii_letters + string.digits + "!@#$%&*()-/<>.? "
-        if all(ch in valid for ch in value):
+        if self.RE_NAME.match(value):
             return value
         raise ParseError("Invalid name: %s." % value)
 
     def parse_frequency(self, value):
         """
         Parses and validates a channel frequency, and
-        converts it to nn.mmmm string format.
+        converts it to 100 Hz units.
         """
         if value:
             match = self.RE_FREQ.match(value)
             if match:
-                return ".".join((
-                    match.group(1).lstrip("0"),
-                    (match.group(2) or "")[:5].lstrip(".").ljust(4, "0")
-                ))
+                decimals = (match.group(2) or "")[:5].lstrip(".").ljust(4, "0")
+                frequency = int(match.group(1)) * 10000 + int(decimals)
+                if not is_supported_frequency(frequency):
+                    raise ParseError("Unsupported frequency: %s." % value)
+                return frequency
         raise ParseError("Invalid frequency: %s." % value)
 
     def parse_modulation(self, value):
@@ -64,7 +90,7 @@ class Importer(object):
         if value is None:
             return "AUTO"
         modulation = value.upper()
-        if modulation in ("FM", "AM", "AUTO", "NFM"):
+        if modulation in self.MODULATIONS:
             return modulation
         raise ParseError("Invalid modulation: %s." % value)
 
@@ -73,34 +99,37 @@ class Importer(object):
         if value is None:
             return 0
 
-        if value in ("", "none", "all"):
-            return 0
-        if value in ("search",):
-            return 127
-        if value in ("notone", "no tone"):
-            return 240
+        # Common notations
+        code = TQ_CODES.get(value.lower())
+        if code is not None:
+            return code
 
+        # Notations with unusual whitespace
         match = self.RE_CTCSS.match(value)
         if match:
             ctcss = match.group(1).lstrip("0")
-            if ctcss in CTCSS_TONES:
-                return CTCSS_TONES.index(ctcss) + 64
+            if ctcss in CTCSS_LOOKUP:
+                return CTCSS_LOOKUP[ctcss]
 
         match = self.RE_DCS.match(value)
         if match:
             dcs = match.group(1).zfill(3)
-            if dcs in DCS_CODES:
-                return DCS_CODES.index(dcs) + 128
-        
+            if dcs in DCS_LOOKUP:
+                return DCS_LOOKUP[dcs]
+
         raise ParseError("Invalid CTCSS/DCS: %s." % value)
 
     def parse_delay(self, value):
         """Parses and validates a channel delay."""
         if value is None:
             return 2
+        if value in self.DELAYS:
+            return self.DELAYS[value]
+
+        # Other notations, such as 02 or +2
         try:
             delay = int(value)
-            if delay in (-10, -5, 0, 1, 2, 3, 4, 5):
+            if delay in self.DELAYS.values():
                 return delay
         except ValueError:
             pass
@@ -112,10 +141,8 @@ class Importer(object):
         if value is None:
             return False
         flag = value.lower()
-        if flag in ("0", "no", "false"):
-            return False
-        elif flag in ("1", "yes", "true"):
-            return True
+        if flag in self.FLAGS:
+            return self.FLAGS[flag]
         raise ParseError("Invalid flag: %s." % value)
 
     def parse_priority(self, value):
@@ -132,40 +159,27 @@ class Importer(object):
         except ParseError:
             raise ParseError("Invalid lockout: %s." % value)
 
-    def get_column(self, data, index):
-        """Safe list getter."""
-        if len(data) > index and data[index]:
-            return data[index]
-
     def parse_row(self, row):
         """Parse a csv row to a channel object."""
-        fields = (
-            "index",
-            "name",
-            "frequency",
-            "modulation",
-            "tqcode",
-            "delay",
-            "lockout",
-            "priority",
-        )
+        # Missing and empty columns are parsed as None
+        values = [value or None for value in row[:8]]
+        values.extend([None] * (8 - len(values)))
 
-        data = {}
-        for index, field in enumerate(fields):
-            value = self.get_column(row, index)
-            fn = getattr(self, "parse_" + field)
-            data[field] = fn(value)
-
-        return Channel(**data)
+        return Channel(*[parse(value)
+            for parse, value in zip(self.parsers, values)])
 
     def print_error(self, line, err):
         print("Error on line %d: %s" % (line, err), file=sys.stderr)
 
-    def read(self):
-        # Parsed channels
-        channels = {}
-        # Number of encountered errors
-        errors = 0
+    def iter_channels(self):
+        """
+        Parse channels while reading the csv data.
+
+        Yields a channel object for every valid row and a ParseError,
+        with the line attribute set, for every invalid row.
+        """
+        # Channel indexes seen before
+        seen = bytearray(ChannelTable.SIZE + 1)
 
         for row, data in enumerate(self.csvreader):
             # Skip first row (header)
@@ -180,8 +194,8 @@ class Importer(object):
             if len(data) < 3:
                 continue
 
-            # Trim whitespace
-            data = list(map(str.strip, data))
+            # Trim whitespace, additional columns are ignored
+            data = [value.strip() for value in data[:8]]
 
             # Empty channel or comment
             if not data[0] or data[0].startswith("#"):
@@ -193,14 +207,27 @@ class Importer(object):
 
             try:
                 channel = self.parse_row(data)
+                if seen[channel.index]:
+                    raise ParseError("Channel %d was seen before." % \
+                        channel.index)
             except ParseError as err:
-                self.print_error(row + 1, err)
-                errors += 1
+                err.line = row + 1
+                yield err
                 continue
 
-            if channel.index in channels:
-                self.print_error(row + 1, "Channel %d was seen before." % \
-                    channel.index)
+            seen[channel.index] = 1
+            yield channel
+
+    def read(self):
+        """Parse all channels, or return None if any row is invalid."""
+        # Parsed channels
+        channels = ChannelTable()
+        # Number of encountered errors
+        errors = 0
+
+        for channel in self.iter_channels():
+            if isinstance(channel, ParseError):
+                self.print_error(channel.line, channel)
                 errors += 1
                 continue
 
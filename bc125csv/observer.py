@@ -0,0 +1,147 @@
+"""
+Hooks reporting commands and operations to monitoring.
+"""
+
+import os
+import copy
+import contextlib
+import threading
+import collections
+
+from bc125csv.cache import replace_file
+from bc125csv.profiler import get_kind
+from bc125csv.scanner import Scanner, timer
+
+
+class Observer(object):
+    """
+    Notified of the commands sent to a scanner and spans of operations.
+
+    Set as the observer of a scanner, or given to the Handler, and
+    override the methods of interest. Scanners without an observer
+    skip the hooks altogether.
+    """
+
+    def command(self, command, response):
+        """A command was answered, response is None if no answer came."""
+
+    def retry(self, command):
+        """A command is sent again after an error."""
+
+    def span_started(self, name):
+        """An operation, like import or programming, started."""
+
+    def span_ended(self, name, seconds, error):
+        """An operation ended, error is the exception it failed with."""
+
+    def for_device(self, device):
+        """Observer for one of multiple devices used at once."""
+        return self
+
+    @contextlib.contextmanager
+    def span(self, name):
+        """Report the block as an operation."""
+        start = timer()
+        self.span_started(name)
+        error = None
+        try:
+            yield
+        except BaseException as err:
+            error = err
+            raise
+        finally:
+            self.span_ended(name, timer() - start, error)
+
+
+class PrometheusObserver(Observer):
+    """
+    Write counters in the Prometheus text format.
+
+    The file is replaced at once after every outermost operation, for
+    the textfile collector of the node exporter. Counters add up while
+    the observer lives, like across commands run by the daemon.
+    Observers for a device share the counters, labelling them with the
+    device.
+    """
+
+    def __init__(self, filename):
+        # Commands run by the daemon change the working directory
+        self.filename = os.path.abspath(filename)
+        self.device = None
+        self.lock = threading.Lock()
+        # Open spans, the file is written when none are left
+        self.depth = collections.Counter()
+        # Counts by (device, label value)
+        self.commands = collections.Counter()
+        self.errors = collections.Counter()
+        self.retries = collections.Counter()
+        self.transferred = collections.Counter()
+        self.spans = collections.Counter()
+        self.failures = collections.Counter()
+        self.seconds = collections.Counter()
+
+    def for_device(self, device):
+        observer = copy.copy(self)
+        observer.device = device
+        return observer
+
+    def command(self, command, response):
+        kind = self.device, get_kind(command)
+        with self.lock:
+            self.commands[kind] += 1
+            self.transferred[self.device, "sent"] += len(command) + 1
+            if response is None or Scanner.check_response(response) is None:
+                self.errors[kind] += 1
+            if response is not None:
+                self.transferred[self.device, "received"] += len(response) + 1
+
+    def retry(self, command):
+        with self.lock:
+            self.retries[self.device, get_kind(command)] += 1
+
+    def span_started(self, name):
+        with self.lock:
+            self.depth["spans"] += 1
+
+    def span_ended(self, name, seconds, error):
+        span = self.device, name
+        with self.lock:
+            self.depth["spans"] -= 1
+            self.spans[span] += 1
+            self.seconds[span] += seconds
+            if error is not None and not (isinstance(error, SystemExit) and
+                    not error.code):
+                self.failures[span] += 1
+            if not self.depth["spans"]:
+                self.write()
+
+    def format(self):
+        """Counters in the Prometheus text format."""
+        lines = []
+        for name, text, label, counter in (
+                ("commands", "Commands sent to the scanner.", "command",
+                    self.commands),
+                ("errors", "Commands answered with an error or not at all.",
+                    "command", self.errors),
+                ("retries", "Commands sent again after an error.", "command",
+                    self.retries),
+                ("bytes", "Bytes transferred.", "direction", self.transferred),
+                ("spans", "Operations run.", "span", self.spans),
+                ("span_failures", "Operations that failed.", "span",
+                    self.failures),
+                ("span_seconds", "Seconds spent in operations.", "span",
+                    self.seconds)):
+            lines.append("# HELP bc125csv_%s_total %s" % (name, text))
+            lines.append("# TYPE bc125csv_%s_total counter" % name)
+            for (device, value), count in sorted(counter.items(),
+                    key=lambda item: (item[0][0] or "", item[0][1])):
+                labels = '%s="%s"' % (label, value)
+                if device:
+                    labels = 'device="%s",%s' % (device, labels)
+                lines.append("bc125csv_%s_total{%s} %s" % (name, labels,
+                    count))
+        return "\n".join(lines) + "\n"
+
+    def write(self):
+        # Readable by the node exporter
+        replace_file(self.filename, self.format(), 0o666)
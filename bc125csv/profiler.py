@@ -0,0 +1,155 @@
+"""
+Timing of the commands sent to the scanner.
+"""
+
+from __future__ import division
+
+import json
+import math
+import collections
+
+from bc125csv.scanner import timer
+
+# Upper bounds of the latency histogram buckets, in milliseconds
+BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+
+def get_kind(command):
+    """Type of a command for grouping timings."""
+    name = command.split(",", 1)[0]
+    if name == "CIN":
+        return "CIN write" if command.count(",") > 1 else "CIN read"
+    return name
+
+
+def percentile(values, percent):
+    """Nearest rank percentile of sorted values."""
+    return values[max(int(math.ceil(percent / 100 * len(values))) - 1, 0)]
+
+
+class Record(object):
+    """
+    Timing of a single command, in seconds since the profiler started.
+
+    The first and last byte are the times at which the first and last
+    part of the response were received.
+    """
+
+    __slots__ = ("command", "response", "write", "written", "flushed",
+        "first", "last")
+
+    def __init__(self, command, write, written, flushed):
+        self.command = command
+        self.response = None
+        self.write = write
+        self.written = written
+        self.flushed = flushed
+        self.first = None
+        self.last = None
+
+    @property
+    def latency(self):
+        """Seconds from writing the command to its complete response."""
+        return self.last - self.write
+
+    def as_dict(self):
+        return dict((name, getattr(self, name)) for name in self.__slots__)
+
+
+class Profiler(object):
+    """
+    Record the timing of commands sent to the scanner.
+
+    The scanner sends commands through the profiler while it is set as
+    its profiler. Responses are matched to commands in order, as the
+    scanner handles pipelined commands in order.
+    """
+
+    def __init__(self):
+        self.start = timer()
+        self.records = []
+        self.pending = collections.deque()
+
+    def now(self):
+        return timer() - self.start
+
+    def writecommand(self, scanner, command):
+        """Write and flush a command."""
+        write = self.now()
+        scanner.writecommand(command)
+        written = self.now()
+        scanner.flush()
+        self.pending.append(Record(command, write, written, self.now()))
+
+    def readlinecr(self, scanner):
+        """Read the response to the oldest command without response."""
+        start = self.now()
+        response = scanner.readlinecr()
+        record = self.pending.popleft()
+        record.response = response
+        record.last = self.now()
+
+        # Transports not keeping track of received data
+        first = getattr(scanner, "rxfirst", None)
+        record.first = start if first is None else first - self.start
+
+        self.records.append(record)
+        return response
+
+    def summary(self):
+        """Latency percentiles and histogram in milliseconds by command type."""
+        latencies = collections.defaultdict(list)
+        for record in self.records:
+            latencies[get_kind(record.command)].append(record.latency * 1000)
+
+        summary = {}
+        for kind, values in latencies.items():
+            values.sort()
+            histogram = [0] * (len(BUCKETS) + 1)
+            for value in values:
+                histogram[sum(1 for bound in BUCKETS if value > bound)] += 1
+            summary[kind] = {
+                "count": len(values),
+                "p50": percentile(values, 50),
+                "p95": percentile(values, 95),
+                "p99": percentile(values, 99),
+                "histogram": histogram,
+            }
+        return summary
+
+    def throughput(self):
+        """Duration in seconds, and channels and bytes per second."""
+        seconds = self.records[-1].last if self.records else 0
+        channels = sum(1 for record in self.records
+            if record.command[:3] in ("CIN", "DCH"))
+        transferred = sum(len(record.command) + len(record.response) + 2
+            for record in self.records)
+        if not seconds:
+            return seconds, None, None
+        return seconds, channels / seconds, transferred / seconds
+
+    def report(self):
+        """Human readable summary."""
+        lines = ["%-10s %7s %9s %9s %9s" % ("Command", "Count", "p50 ms",
+            "p95 ms", "p99 ms")]
+        for kind, stats in sorted(self.summary().items()):
+            lines.append("%-10s %7d %9.2f %9.2f %9.2f" % (kind, stats["count"],
+                stats["p50"], stats["p95"], stats["p99"]))
+
+        seconds, channels, transferred = self.throughput()
+        if seconds:
+            lines.append("%.2f s, %.1f channels/s, %.0f bytes/s" % (seconds,
+                channels, transferred))
+        return "\n".join(lines)
+
+    def write_trace(self, fh):
+        """Write the summary and all command timings as JSON."""
+        seconds, channels, transferred = self.throughput()
+        json.dump({
+            "buckets": BUCKETS,
+            "seconds": seconds,
+            "channels_per_second": channels,
+            "bytes_per_second": transferred,
+            "summary": self.summary(),
+            "commands": [record.as_dict() for record in self.records],
+        }, fh, indent=2, sort_keys=True)
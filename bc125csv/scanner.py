@@ -3,6 +3,10 @@ from __future__ import division
 
 import re
 import sys
+import time
+import bisect
+import contextlib
+import collections
 
 try:
     import pyudev
@@ -42,16 +46,100 @@ DCS_CODES = [
     "732","734","743","754",
 ]
 
+# Readable CTCSS tones and DCS codes by scanner code
+TQ_LABELS = {0: "none", 127: "search", 240: "no tone"}
+TQ_LABELS.update((code, tone + " Hz")
+    for code, tone in enumerate(CTCSS_TONES, 64))
+TQ_LABELS.update((code, "DCS " + dcs)
+    for code, dcs in enumerate(DCS_CODES, 128))
+
+# Scanner codes by CTCSS tone and DCS code
+CTCSS_LOOKUP = dict((tone, code) for code, tone in enumerate(CTCSS_TONES, 64))
+DCS_LOOKUP = dict((dcs, code) for code, dcs in enumerate(DCS_CODES, 128))
+
+
+def create_tq_codes():
+    """
+    Scanner codes by common lowercase notations, such as "114.8",
+    "114.8 hz", "ctcss 114.8hz", "26", "dcs026" and "dcs 026".
+    """
+    codes = {"": 0, "none": 0, "all": 0, "search": 127, "notone": 240,
+        "no tone": 240}
+    for tone, code in CTCSS_LOOKUP.items():
+        for number in set((tone, tone.zfill(5))):
+            for prefix in ("", "ctcss", "ctcss "):
+                for suffix in ("", "hz", " hz"):
+                    codes[prefix + number + suffix] = code
+    for dcs, code in DCS_LOOKUP.items():
+        for number in set((dcs, dcs[1:] if dcs[0] == "0" else dcs)):
+            for prefix in ("", "dcs", "dcs "):
+                codes[prefix + number] = code
+    return codes
+
+
+TQ_CODES = create_tq_codes()
+
+# Supported frequency ranges in 100 Hz units and their channel steps in Hz
+BANDS = (
+    (250000, 540000, (5000,)),
+    (1080000, 1370000, (5000, 25000.0 / 3)),
+    (1370000, 1740000, (5000, 6250, 7500)),
+    (2250000, 3800000, (5000, 6250, 12500)),
+    (4000000, 5120000, (5000, 6250, 12500)),
+)
+BAND_STARTS = [start for start, end, steps in BANDS]
+BAND_ENDS = [end for start, end, steps in BANDS]
+BAND_STEPS = [steps for start, end, steps in BANDS]
+
 SUPPORTED_MODELS = ("BC125AT", "UBC125XLT", "UBC126AT")
 
+# USB vendor id of Uniden
+VENDOR_ID = "1965"
+
+# Monotonic clock where available
+timer = getattr(time, "perf_counter", time.time)
+
+
+def format_frequency(frequency):
+    """Format a frequency in 100 Hz units as MHz (nnn.mmmm)."""
+    return "%d.%04d" % divmod(frequency, 10000)
+
+
+def is_supported_frequency(frequency):
+    """
+    Whether a frequency in 100 Hz units is in a supported band and on
+    one of its channel steps. Frequencies are stored with 100 Hz
+    precision, so a step may be off by less than 100 Hz.
+    """
+    band = bisect.bisect_right(BAND_STARTS, frequency) - 1
+    if band < 0 or frequency > BAND_ENDS[band]:
+        return False
+
+    # Steps are counted from 0 Hz, like 7.5 kHz VHF narrowband channels
+    for step in BAND_STEPS[band]:
+        remainder = frequency * 100 % step
+        if remainder < 100 or step - remainder < 100:
+            return True
+    return False
+
 
 class Channel(object):
     """
     Representation of a channel in the scanner.
+
+    The frequency is an integer in 100 Hz units, strings in MHz
+    (nnn.mmmm) are converted.
     """
 
+    __slots__ = ("index", "name", "frequency", "modulation", "tqcode",
+        "delay", "lockout", "priority")
+
     def __init__(self, index, name, frequency, modulation="AUTO", tqcode=0, 
         delay=2, lockout=False, priority=False):
+        if isinstance(frequency, str):
+            mhz, _, decimals = frequency.partition(".")
+            frequency = int(mhz or 0) * 10000 + int(decimals[:4].ljust(4, "0"))
+
         self.index = index
         self.name = name
         self.frequency = frequency
@@ -64,24 +152,164 @@ class Channel(object):
     @property
     def tq(self):
         """Readable CTCSS tone and DCS code."""
-        if self.tqcode == 0:
-            return "none"
-        if self.tqcode == 127:
-            return "search"
-        if self.tqcode == 240:
-            return "no tone"
-        if 64 <= self.tqcode <= 113:
-            return CTCSS_TONES[self.tqcode - 64] + " Hz"
-        if 128 <= self.tqcode <= 231:
-            return "DCS " + DCS_CODES[self.tqcode - 128]
+        return TQ_LABELS.get(self.tqcode)
 
     @property
     def freqcode(self):
         """Frequency code in CIN format (nnnnmmmm)."""
-        return self.frequency.replace(".", "").zfill(8)
+        return "%08d" % self.frequency
+
+    def __eq__(self, other):
+        if not isinstance(other, Channel):
+            return NotImplemented
+        return (
+            self.index == other.index and
+            self.name == other.name and
+            self.frequency == other.frequency and
+            self.modulation == other.modulation and
+            self.tqcode == other.tqcode and
+            self.delay == other.delay and
+            bool(self.lockout) == bool(other.lockout) and
+            bool(self.priority) == bool(other.priority)
+        )
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        if equal is NotImplemented:
+            return equal
+        return not equal
+
+    __hash__ = None
+
+    def __repr__(self):
+        return "CH%03d: %s %s" % (self.index, format_frequency(self.frequency),
+            self.modulation)
+
+
+class ChannelTable(object):
+    """
+    Channels by index, None for channels known to be empty.
+
+    Behaves like a dict of channels, but iterates over indexes in order
+    and is backed by a list with a slot for each of the 500 channels.
+    """
+
+    __slots__ = ("slots",)
+
+    SIZE = 500
+
+    # Marks slots without channel information
+    MISSING = object()
+
+    def __init__(self, channels=None):
+        self.slots = [self.MISSING] * (self.SIZE + 1)
+        if channels:
+            self.update(channels)
+
+    def __getitem__(self, index):
+        if 0 < index <= self.SIZE:
+            channel = self.slots[index]
+            if channel is not self.MISSING:
+                return channel
+        raise KeyError(index)
+
+    def __setitem__(self, index, channel):
+        if not 0 < index <= self.SIZE:
+            raise KeyError(index)
+        self.slots[index] = channel
+
+    def __delitem__(self, index):
+        self[index]
+        self.slots[index] = self.MISSING
+
+    def __contains__(self, index):
+        return 0 < index <= self.SIZE and self.slots[index] is not self.MISSING
+
+    def __iter__(self):
+        missing = self.MISSING
+        return (index for index, channel in enumerate(self.slots)
+            if index and channel is not missing)
+
+    def __len__(self):
+        return self.SIZE + 1 - self.slots.count(self.MISSING)
+
+    def __eq__(self, other):
+        if not isinstance(other, ChannelTable):
+            # Only compare with mappings, not with None or empty sequences
+            if not hasattr(other, "items"):
+                return NotImplemented
+            try:
+                other = ChannelTable(other)
+            except (TypeError, ValueError, KeyError):
+                return NotImplemented
+        return self.slots[1:] == other.slots[1:]
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        if equal is NotImplemented:
+            return equal
+        return not equal
+
+    __hash__ = None
 
     def __repr__(self):
-        return "CH%03d: %s %s" % (self.index, self.frequency, self.modulation)
+        return "ChannelTable(%r)" % dict(self.items())
+
+    def get(self, index, default=None):
+        if index in self:
+            return self.slots[index]
+        return default
+
+    def pop(self, index, default=MISSING):
+        if index in self:
+            channel = self.slots[index]
+            self.slots[index] = self.MISSING
+            return channel
+        if default is self.MISSING:
+            raise KeyError(index)
+        return default
+
+    def clear(self):
+        self.slots[:] = [self.MISSING] * (self.SIZE + 1)
+
+    def update(self, channels):
+        """Add channels from a mapping or (index, channel) pairs."""
+        if hasattr(channels, "items"):
+            channels = channels.items()
+        for index, channel in channels:
+            self[index] = channel
+
+    def copy(self):
+        """Shallow copy, sharing the channel objects."""
+        table = ChannelTable()
+        table.slots[:] = self.slots
+        return table
+
+    def keys(self):
+        return list(self)
+
+    def values(self):
+        return [channel for channel in self.slots[1:]
+            if channel is not self.MISSING]
+
+    def items(self):
+        missing = self.MISSING
+        return [(index, channel) for index, channel in enumerate(self.slots)
+            if index and channel is not missing]
+
+    def bank(self, bank):
+        """Channels in a bank as (index, channel) pairs."""
+        start = bank * 50 - 49
+        missing = self.MISSING
+        return [(index, channel) for index, channel
+            in enumerate(self.slots[start:start + 50], start)
+            if channel is not missing]
+
+    def diff(self, other):
+        """Indexes of channels that differ from another table."""
+        return [index for index, (mine, theirs)
+            in enumerate(zip(self.slots, other.slots))
+            if index and mine != theirs]
 
 
 class ScannerException(Exception):
@@ -93,6 +321,7 @@ class Scanner(serial.Serial, object):
     Wrap around Serial to provide compatible readline and helper methods.
     """
     
+    # Format of CIN responses, parse_channel checks the same
     RE_CIN = re.compile(r"""
         # CIN,[INDEX],[NAME],[FRQ],[MOD],[CTCSS/DCS],[DLY],[LOUT],[PRI]
         ^ # No characters before
@@ -108,31 +337,225 @@ class Scanner(serial.Serial, object):
         $ # No characters after
         """, flags=re.VERBOSE)
 
-    def __init__(self, port, baudrate=9600): # pragma: no cover
-        super(Scanner, self).__init__(port=port, baudrate=baudrate)
+    # Valid values in CIN responses
+    CIN_MODULATIONS = frozenset(("AUTO", "AM", "FM", "NFM"))
+    CIN_DELAYS = dict((str(delay), delay) for delay in (-10, -5, 0, 1, 2, 3, 4, 5))
+    CIN_FLAGS = {"0": False, "1": True}
+
+    # Number of commands sent ahead of their responses in send_many
+    WINDOW = 8
+
+    # Supported baud rates
+    RATES = (4800, 9600, 19200, 38400, 57600, 115200)
+
+    # Number of nested programming sessions
+    sessions = 0
+
+    # Retries of channel commands getting an error, per command and per
+    # programming session, and the delay before the first retry, which
+    # doubles on every next retry
+    retries = 0
+    RETRY_BUDGET = 50
+    retry_budget = RETRY_BUDGET
+    retry_delay = 0.05
+
+    # Profiler timing the commands, if any
+    profiler = None
+    # Observer notified of commands, if any
+    observer = None
+    # Time at which the last data and the current line were received
+    rxtime = None
+    rxfirst = None
+
+    def __init__(self, port, baudrate=9600, timeout=None): # pragma: no cover
+        # Received data not yet returned by readlinecr
+        self.rxbuffer = bytearray()
+        # Known channel contents by index, None for empty channels
+        self.state = ChannelTable()
+        # Number of retries by command name
+        self.retried = collections.Counter()
+        super(Scanner, self).__init__(port=port, baudrate=baudrate,
+            timeout=timeout)
+
+    def writecommand(self, command): # pragma: no cover
+        self.write((command + "\r").encode())
 
     def writeread(self, command): # pragma: no cover
-        self.write((command + "\r").encode())
+        self.writecommand(command)
         self.flush()
         return self.readlinecr()
 
-    def send(self, command):
-        result = self.writeread(command)
+    @staticmethod
+    def check_response(result):
+        """Return the response, or None if the scanner reported an error."""
         if not re.match(r"(^ERR|,NG$)", result):
             return result
 
-    def readlinecr(self): # pragma: no cover
+    def send(self, command, retry=False):
+        if self.profiler or self.observer:
+            self.transmit(command)
+            result = self.check_response(self.receive(command))
+        else:
+            result = self.check_response(self.writeread(command))
+        if retry:
+            result = self.retry(command, result)
+        return result
+
+    def transmit(self, command):
+        """Write and flush a command, timed when profiling."""
+        if self.profiler:
+            self.profiler.writecommand(self, command)
+        else:
+            self.writecommand(command)
+            self.flush()
+
+    def receive(self, command):
+        """Read the response to a command, timed when profiling."""
+        response = None
+        try:
+            if self.profiler:
+                response = self.profiler.readlinecr(self)
+            else:
+                response = self.readlinecr()
+        finally:
+            if self.observer:
+                self.observer.command(command, response)
+        return response
+
+    def send_many(self, commands, window=None, retry=False):
+        """
+        Send multiple commands without waiting for each response.
+
+        Up to window commands are in flight at any time. The scanner
+        handles commands in order, so responses are returned in the
+        order of the commands, with None for errors as in send. With
+        retry set, commands getting an error are retried afterwards.
+        """
+        commands = list(commands)
+        window = window or self.WINDOW
+        results = []
+        pending = 0
+
+        for command in commands:
+            if pending == window:
+                results.append(self.check_response(
+                    self.receive(commands[len(results)])))
+                pending -= 1
+            self.transmit(command)
+            pending += 1
+
+        for _ in range(pending):
+            results.append(self.check_response(
+                self.receive(commands[len(results)])))
+
+        if retry:
+            results = [self.retry(command, result)
+                for command, result in zip(commands, results)]
+
+        return results
+
+    def retry(self, command, result):
+        """
+        Send a command again while its result is an error.
+
+        Waits before every retry, twice as long as before the previous
+        one. Gives up after the number of retries per command, or when
+        the retry budget is used up.
+        """
+        delay = self.retry_delay
+        for _ in range(self.retries):
+            if result is not None or self.retry_budget <= 0:
+                break
+            time.sleep(delay)
+            delay *= 2
+            self.retry_budget -= 1
+            self.retried[command.split(",")[0]] += 1
+            if self.observer:
+                self.observer.retry(command)
+            result = self.send(command)
+        return result
+
+    def readlinecr(self):
         """
         The Serial class might be based on serial.FileLike, which allows
         one to override the eol character, and io.RawIOBase, which doesn't.
         To ensure this possibility, the readline method is overriden.
+
+        All waiting bytes are read at once and anything received after
+        the carriage return is kept for the next call. If the port has a
+        timeout and no data arrives in time, ScannerException is raised.
         """
-        line = ""
+        start = 0
+        if self.profiler:
+            # Start of the line arrived with the last data
+            self.rxfirst = self.rxtime if self.rxbuffer else None
         while True:
-            c = self.read(1).decode()
-            if c == "\r":
-                return line
-            line += c
+            end = self.rxbuffer.find(b"\r", start)
+            if end != -1:
+                line = bytes(self.rxbuffer[:end])
+                del self.rxbuffer[:end + 1]
+                try:
+                    return line.decode()
+                except UnicodeDecodeError:
+                    raise ScannerException("Garbled response from scanner.")
+            start = len(self.rxbuffer)
+            data = self.read(self.in_waiting or 1)
+            if not data:
+                raise ScannerException("No response from scanner.")
+            if self.profiler:
+                self.rxtime = timer()
+                self.rxfirst = self.rxfirst or self.rxtime
+            self.rxbuffer.extend(data)
+
+    def set_rate(self, rate): # pragma: no cover
+        """Change the baud rate, discarding any data received."""
+        self.baudrate = rate
+        self.reset_input_buffer()
+        del self.rxbuffer[:]
+
+    def probe_rate(self, rates=None, handshakes=2):
+        """
+        Find the fastest baud rate at which the scanner answers cleanly.
+
+        Rates are tried fastest first. A rate works when the last number
+        of handshakes MDL commands all return the same model name, one
+        extra attempt is made for leftovers from the previous rate. The
+        scanner is left at the working rate.
+        """
+        for rate in sorted(rates or self.RATES, reverse=True):
+            self.set_rate(rate)
+            models = []
+            for _ in range(handshakes + 1):
+                try:
+                    models.append(self.get_model())
+                except ScannerException:
+                    models.append(None)
+
+                recent = set(models[-handshakes:])
+                if len(models) >= handshakes and len(recent) == 1 \
+                        and None not in recent:
+                    return rate
+
+        raise ScannerException("No working baud rate found.")
+
+    @contextlib.contextmanager
+    def programming(self):
+        """
+        Keep the scanner in programming mode within the block.
+
+        Nested blocks share the session of the outermost block, which
+        enters and leaves programming mode once.
+        """
+        if not self.sessions:
+            self.enter_programming()
+            self.retry_budget = self.RETRY_BUDGET
+        self.sessions += 1
+        try:
+            yield self
+        finally:
+            self.sessions -= 1
+            if not self.sessions:
+                self.exit_programming()
 
     def enter_programming(self):
         result = self.send("PRG")
@@ -151,44 +574,55 @@ class Scanner(serial.Serial, object):
             raise ScannerException("Could not get model name.")
         return result[4:]
 
-    def get_channel(self, index):
-        """Read channel object from scanner."""
-        result = self.send("CIN,%d" % index)
+    def get_version(self):
+        """Get firmware version from scanner."""
+        result = self.send("VER")
+        if not result or not result.startswith("VER,"):
+            raise ScannerException("Could not get firmware version.")
+        return result[4:]
 
+    @classmethod
+    def parse_channel(cls, index, result):
+        """Convert a CIN response to a channel object."""
         # Error occurred
         if not result:
             raise ScannerException("Could not read channel %d." %  index)
 
-        # Try to match result
-        match = self.RE_CIN.match(result)
-        if not match:
+        # Check the fields as RE_CIN would, names can't contain commas
+        fields = result.split(",")
+        try:
+            (command, number, name, freq, modulation, tq, delay, lockout,
+                priority) = fields
+            if not (command == "CIN" and
+                    0 < len(number) <= 3 and number.isdigit() and
+                    len(name) <= 16 and
+                    4 < len(freq) <= 8 and freq.isdigit() and
+                    modulation in cls.CIN_MODULATIONS and
+                    0 < len(tq) <= 3 and tq.isdigit() and
+                    delay in cls.CIN_DELAYS and
+                    lockout in cls.CIN_FLAGS and
+                    priority in cls.CIN_FLAGS):
+                raise ValueError
+            # Only ASCII digits are accepted by int()
+            number, frequency, tqcode = int(number), int(freq), int(tq)
+        except ValueError:
             raise ScannerException("Unexpected data for channel %d." %  index)
-        data = match.groupdict()
 
         # Return on empty channel
-        if data["freq"] == "00000000":
+        if not frequency:
             return
 
-        # Convert 1290000 to 129.0000
-        frequency = "%s.%s" % (data["freq"][:-4].lstrip("0"), data["freq"][-4:])
-
-        return Channel(**{
-            "index":      int(data["index"]),
-            "name":       data["name"].strip(),
-            "frequency":  frequency,
-            "modulation": data["modulation"],
-            "tqcode":     int(data["tq"]),
-            "delay":      int(data["delay"]),
-            "lockout":    data["lockout"] == "1",
-            "priority":   data["priority"] == "1",
-        })
+        return Channel(number, name.strip(), frequency, modulation, tqcode,
+            cls.CIN_DELAYS[delay], cls.CIN_FLAGS[lockout], cls.CIN_FLAGS[priority])
 
-    def set_channel(self, channel):
-        """Write channel object to scanner."""
-        command = ",".join(map(str, [
+    @staticmethod
+    def format_channel(channel):
+        """Convert a channel object to a CIN write command."""
+        return ",".join(map(str, [
             "CIN",
             channel.index,
-            channel.name,
+            # The scanner keeps 16 characters
+            channel.name[:16],
             channel.freqcode,
             channel.modulation,
             channel.tqcode,
@@ -197,37 +631,135 @@ class Scanner(serial.Serial, object):
             int(channel.priority),
         ]))
 
-        # Write to scanner
-        result = self.send(command)
+    @classmethod
+    def stored_channel(cls, channel):
+        """Channel as the scanner stores it, to compare with read channels."""
+        if not channel:
+            return channel
+        return cls.parse_channel(channel.index, cls.format_channel(channel))
+
+    def forget(self, indexes=None):
+        """Clear the known state of given channels, or of all channels."""
+        if indexes is None:
+            self.state.clear()
+        for index in indexes or ():
+            self.state.pop(index, None)
+
+    def get_channel(self, index):
+        """Read channel object from scanner."""
+        result = self.send("CIN,%d" % index, retry=True)
+        channel = self.parse_channel(index, result)
+        self.state[index] = channel
+        return channel
+
+    def get_channels(self, indexes):
+        """Read channel objects from scanner, pipelining the requests."""
+        indexes = list(indexes)
+        results = self.send_many(("CIN,%d" % index for index in indexes),
+            retry=True)
+        channels = [self.parse_channel(index, result)
+            for index, result in zip(indexes, results)]
+        self.state.update(zip(indexes, channels))
+        return channels
+
+    def set_channel(self, channel):
+        """Write channel object to scanner."""
+        result = self.send(self.format_channel(channel), retry=True)
         if not result or result != "CIN,OK":
             raise ScannerException("Could not write to channel %d." % channel.index)
+        self.state[channel.index] = self.stored_channel(channel)
+
+    def set_channels(self, channels):
+        """Write channel objects to scanner, pipelining the requests."""
+        channels = list(channels)
+        results = self.send_many(map(self.format_channel, channels), retry=True)
+        for channel, result in zip(channels, results):
+            if not result or result != "CIN,OK":
+                raise ScannerException("Could not write to channel %d." % channel.index)
+            self.state[channel.index] = self.stored_channel(channel)
+
+    def delete_channel(self, index, revalidate=False):
+        """Delete channel from scanner.
+
+        The known channel state is trusted unless revalidate is set.
+        """
+        if revalidate or index not in self.state:
+            channel = self.get_channel(index)
+        else:
+            channel = self.state[index]
 
-    def delete_channel(self, index):
-        """Delete channel from scanner."""
-        channel = self.get_channel(index)
-        
         # Only delete if channel has data
         # Unnecessary deletes are slow
         if channel:
-            result = self.send("DCH,%d" % index)
+            result = self.send("DCH,%d" % index, retry=True)
             if not result or result != "DCH,OK":
                 raise ScannerException("Could not delete channel %d." % index)
+            self.state[index] = None
+
+    def delete_channels(self, indexes, revalidate=False):
+        """Delete channels from scanner, pipelining the requests.
+
+        The known channel state is trusted unless revalidate is set.
+        """
+        indexes = list(indexes)
+        self.get_channels(index for index in indexes
+            if revalidate or index not in self.state)
+
+        # Only delete channels that have data
+        indexes = [index for index in indexes if self.state[index]]
+
+        results = self.send_many(("DCH,%d" % index for index in indexes),
+            retry=True)
+        for index, result in zip(indexes, results):
+            if not result or result != "DCH,OK":
+                raise ScannerException("Could not delete channel %d." % index)
+            self.state[index] = None
 
 
 class VirtualScanner(Scanner):
     """
     Virtual scanner to test without an actual scanner.
+
+    Written and deleted channels are remembered.
     """
+    # Plain attribute instead of the serial port setting
+    timeout = None
+
     def __init__(self, *args, **kwargs):
         # Don"t create a Serial object
+        self.responses = collections.deque()
+        self.state = ChannelTable()
+        self.retried = collections.Counter()
+        # Written channels by index, as CIN responses
+        self.memory = {}
+
+    def writecommand(self, command):
+        """Queue the response for readlinecr."""
+        self.responses.append(self.writeread(command))
+
+    def flush(self):
         pass
 
+    def close(self):
+        pass
+
+    def set_rate(self, rate):
+        self.rate = rate
+        self.responses.clear()
+
+    def readlinecr(self):
+        return self.responses.popleft()
+
     def writeread(self, command):
         """Fake the handling of certain commands."""
         # Get model
         if command == "MDL":
             return "MDL,VIRTUAL"
 
+        # Get firmware version
+        if command == "VER":
+            return "VER,Version 1.00.00"
+
         # Programming mode
         if command == "PRG":
             return "PRG,OK"
@@ -236,6 +768,17 @@ class VirtualScanner(Scanner):
         if command == "EPG":
             return "EPG,OK"
 
+        # Channels written before
+        match = re.match(r"^(CIN|DCH),(\d+)(,?)", command)
+        if match:
+            index = int(match.group(2))
+            if match.group(1) == "DCH":
+                self.memory[index] = "CIN,%d,,00000000,AUTO,0,2,0,0" % index
+            elif match.group(3):
+                self.memory[index] = command
+            elif index in self.memory:
+                return self.memory[index]
+
         # Get channel
         if re.match(r"^CIN,([1-9]|1[0-9]|5[1-9])$", command):
             # Return data for channels 1-19 and 51-59
@@ -271,25 +814,51 @@ class DeviceLookup(object): # pragma: no cover
 
     def is_scanner(self, device):
         """Given USB device is a compatible scanner."""
-        return device.get("ID_VENDOR_ID") == "1965" and \
+        return device.get("ID_VENDOR_ID") == VENDOR_ID and \
             device.get("ID_MODEL") in SUPPORTED_MODELS
 
     def is_tty(self, device):
         """Given USB device is a serial tty."""
         return device.get("SUBSYSTEM") == "tty"
 
+    def get_devices(self):
+        """Find all compatible scanners and return their usb devices.
+
+        The tty devices of all scanners are returned. If no scanner has a
+        tty, the first usb device of a scanner is returned instead.
+
+        Only devices of the vendor are enumerated, udev filters the
+        others out.
+        """
+        # Look for scanner ttys
+        devices = [device for device in self.context.list_devices(
+            subsystem="tty", ID_VENDOR_ID=VENDOR_ID) if self.is_scanner(device)]
+        if devices:
+            return devices
+
+        # No scanner with tty, look for scanner
+        for device in self.context.list_devices(ID_VENDOR_ID=VENDOR_ID):
+            if self.is_scanner(device):
+                return [device]
+        return []
+
+    def get_device_by_path(self, path):
+        """Get the scanner tty at a device path, if it is still there."""
+        try:
+            device = pyudev.Devices.from_device_file(self.context, path)
+        except (pyudev.DeviceNotFoundError, ValueError, EnvironmentError):
+            return None
+
+        # Another device might have taken its place
+        if self.is_scanner(device) and self.is_tty(device):
+            return device
+
     def get_device(self):
         """Find compatible scanner and return usb device.
 
         If found a tty device will be returned, otherwise the
         usb device will be returned.
         """
-        # Look for scanner tty
-        for device in self.context.list_devices():
-            if self.is_scanner(device) and self.is_tty(device):
-                return device
-
-        # No scanner with tty, look for scanner
-        for device in self.context.list_devices():
-            if self.is_scanner(device):
-                return device
+        devices = self.get_devices()
+        if devices:
+            return devices[0]
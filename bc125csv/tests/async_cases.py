@@ -0,0 +1,140 @@
+"""
+Tests of the asyncio transport, imported by test_aioscanner on Python 3.7+.
+"""
+
+import asyncio
+
+from bc125csv.aioscanner import AsyncScanner
+from bc125csv.scanner import ScannerException, VirtualScanner
+from bc125csv.tests.base import BaseTestCase
+from bc125csv.tests.test_scanner import ErrorRespondingScanner
+
+
+class VirtualWriter(object):
+    """Stream writer answering like the virtual scanner."""
+    def __init__(self, reader, delay=0, silent=(), scanner=VirtualScanner,
+            drain_delay=0):
+        self.reader = reader
+        self.delay = delay
+        self.drain_delay = drain_delay
+        self.silent = silent
+        self.scanner = scanner()
+        self.commands = []
+
+    def write(self, data):
+        command = data.decode().rstrip("\r")
+        self.commands.append(command)
+        if command in self.silent:
+            return
+        response = (self.scanner.writeread(command) + "\r").encode()
+        if self.delay:
+            asyncio.get_event_loop().call_later(self.delay,
+                self.reader.feed_data, response)
+        else:
+            self.reader.feed_data(response)
+
+    async def drain(self):
+        if self.drain_delay:
+            await asyncio.sleep(self.drain_delay)
+
+    def close(self):
+        pass
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+class AsyncScannerTestCase(BaseTestCase):
+    def create(self, **kwargs):
+        reader = asyncio.StreamReader()
+        writer = VirtualWriter(reader, **kwargs)
+        return AsyncScanner(reader, writer, timeout=0.1), writer
+
+    def test_commands(self):
+        async def test():
+            scanner, writer = self.create()
+            self.assertEqual(await scanner.get_model(), "VIRTUAL")
+            await scanner.enter_programming()
+
+            channel = await scanner.get_channel(1)
+            self.assertEqual(channel.name, "Channel 1")
+            await scanner.set_channel(channel)
+            await scanner.delete_channel(1)
+            await scanner.delete_channel(1)
+            self.assertEqual(await scanner.get_channel(20), None)
+            self.assertEqual(await scanner.send("XYZ"), None)
+
+            await scanner.exit_programming()
+            scanner.close()
+            return writer.commands
+
+        self.assertEqual(run(test()), ["MDL", "PRG", "CIN,1", "CIN,1,Channel 1,"
+            "01010000,FM,0,2,0,0", "DCH,1", "CIN,20", "XYZ", "EPG"])
+
+    def test_errors(self):
+        async def test():
+            scanner, writer = self.create(scanner=ErrorRespondingScanner)
+            channel = VirtualScanner().get_channel(1)
+            for coroutine in (scanner.get_model(), scanner.enter_programming(),
+                    scanner.exit_programming(), scanner.get_channel(1),
+                    scanner.set_channel(channel), scanner.delete_channel(1)):
+                with self.assertRaises(ScannerException):
+                    await coroutine
+
+            scanner, writer = self.create(silent=("MDL",))
+            with self.assertRaises(ScannerException):
+                await scanner.get_model()
+
+        run(test())
+
+    def test_timeout(self):
+        async def test():
+            scanner, writer = self.create(delay=0.2)
+
+            # Late response is discarded before the next command
+            with self.assertRaises(ScannerException):
+                await scanner.get_channel(1)
+            self.assertEqual(scanner.orphans, 1)
+            self.assertEqual(await scanner.send("MDL", 0.5), "MDL,VIRTUAL")
+            self.assertEqual(scanner.orphans, 0)
+
+        run(test())
+
+    def test_drain_timeout(self):
+        async def test():
+            scanner, writer = self.create(drain_delay=0.2)
+
+            # Response to a command stuck in the transport is discarded
+            with self.assertRaises(ScannerException):
+                await scanner.get_channel(1)
+            self.assertEqual(scanner.orphans, 1)
+            writer.drain_delay = 0
+            self.assertEqual(await scanner.send("MDL"), "MDL,VIRTUAL")
+
+            # Cancelled while draining
+            writer.drain_delay = 0.05
+            task = asyncio.ensure_future(scanner.get_channel(1))
+            await asyncio.sleep(0.01)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+            self.assertEqual(scanner.orphans, 1)
+            writer.drain_delay = 0
+            self.assertEqual(await scanner.send("MDL"), "MDL,VIRTUAL")
+
+        run(test())
+
+    def test_cancel(self):
+        async def test():
+            scanner, writer = self.create(delay=0.05)
+
+            task = asyncio.ensure_future(scanner.get_model())
+            await asyncio.sleep(0.01)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+            self.assertEqual(scanner.orphans, 1)
+            self.assertEqual(await scanner.get_channel(20), None)
+
+        run(test())
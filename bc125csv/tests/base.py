@@ -1,4 +1,9 @@
+import os
 import sys
+import shutil
+import tempfile
+
+from bc125csv.scanner import Scanner
 
 try:
     import unittest2 as unittest
@@ -24,11 +29,35 @@ else:
     # Python 3
     import builtins
 
+def create_csv(indexes, name="Channel %d"):
+    """Create csv data with a channel for every index."""
+    lines = ["Channel,Name,Frequency,Modulation,CTCSS/DCS,Delay,Lockout,Priority\n"]
+    for index in indexes:
+        lines.append("%d,%s,%d.%04d,FM,none,2,no,no\n" % (index, name % index,
+            150 + index // 100, index % 100 * 100))
+    return "".join(lines)
+
+
 class BaseTestCase(unittest.TestCase):
     def setUp(self):
         self.stdout, sys.stdout = sys.stdout, StringIO()
         self.stderr, sys.stderr = sys.stderr, StringIO()
 
+        # Keep cache files out of the home directory
+        self.cachedir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cachedir)
+        patcher = mock.patch.dict(os.environ, {"XDG_CACHE_HOME": self.cachedir,
+            "XDG_RUNTIME_DIR": self.cachedir})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # Don't send commands to a running daemon
+        os.environ.pop("BC125CSV_SOCKET", None)
+
+        # Retry without waiting
+        patcher = mock.patch.object(Scanner, "retry_delay", 0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
     def assertStdOut(self, value):
         self.assertEqual(sys.stdout.getvalue().strip(), value.strip())
 
@@ -0,0 +1,80 @@
+import sys
+import json
+
+from bc125csv.scanner import Scanner, ScannerException
+from bc125csv.benchmarks import Benchmarks, create_channels, \
+    create_responses, parse_channel_regex
+from bc125csv.benchmarks.__main__ import main
+from bc125csv.benchmarks.scanner import LatencyScanner
+from bc125csv.tests.base import BaseTestCase
+
+
+class BenchmarksTestCase(BaseTestCase):
+    def test_scanner(self):
+        """
+        Simulated scanner remembers written channels.
+        """
+        scanner = LatencyScanner(latency=0, jitter=0, process=0)
+        channels = create_channels(indexes=range(1, 4))
+        scanner.set_channels(channels.values())
+        scanner.delete_channels([2], revalidate=True)
+        self.assertEqual(scanner.get_channels(range(1, 4)),
+            [channels[1], None, channels[3]])
+
+    def test_run(self):
+        """
+        Run all benchmarks without delays.
+        """
+        main(["-b", "100000000", "-l", "0", "-j", "0", "-p", "0", "-r", "1"])
+        results = json.loads(sys.stdout.getvalue())
+        self.assertEqual(sorted(results["results"]), Benchmarks().names())
+        self.assertEqual(results["settings"]["repeat"], 1)
+        for result in results["results"].values():
+            self.assertEqual(result["items"], 500)
+
+        with self.assertRaises(SystemExit):
+            main(["doesnotexist"])
+
+    def test_parse_channel(self):
+        """
+        Parser agrees with the RE_CIN reference.
+        """
+        responses = [result for _, result in create_responses()] + [
+            "CIN,1,,00000000,AUTO,0,2,0,0",
+            "CIN,1,Sixteen chars ok,01500000,NFM,127,-10,1,1",
+            "CIN,001,  Padded  ,99999,AM,0,-5,0,1",
+            "CIN,1,Seventeen chars!!,01500000,FM,0,2,0,0",
+            "CIN,1,Name,1500,FM,0,2,0,0",
+            "CIN,1,Name,015000000,FM,0,2,0,0",
+            "CIN,1,Name,01500000,WFM,0,2,0,0",
+            "CIN,1,Name,01500000,FM,1000,2,0,0",
+            "CIN,1,Name,01500000,FM,,2,0,0",
+            "CIN,1,Name,01500000,FM,0,6,0,0",
+            "CIN,1,Name,01500000,FM,0,-1,0,0",
+            "CIN,1,Name,01500000,FM,0,2,2,0",
+            "CIN,1,Name,01500000,FM,0,2,0,0,",
+            "CIN,1,Na,me,01500000,FM,0,2,0,0",
+            "CIN,1000,Name,01500000,FM,0,2,0,0",
+            "CIN,,Name,01500000,FM,0,2,0,0",
+            "CIN,-1,Name,01500000,FM,0,2,0,0",
+            "CIN,+1,Name,01500000,FM,0,2,0,0",
+            "CIN,1,Name,+1500000,FM,0,2,0,0",
+            "CIN,1,Name,0150 000,FM,0,2,0,0",
+            u"CIN,\u00b2,Name,01500000,FM,0,2,0,0",
+            "CIN,1,Name,01500000,FM,0,2,0",
+            " CIN,1,Name,01500000,FM,0,2,0,0",
+            "CIN,OK",
+            "CIN",
+            "",
+            None,
+        ]
+
+        def parse(parser, result):
+            try:
+                return parser(1, result)
+            except ScannerException as err:
+                return str(err)
+
+        for result in responses:
+            self.assertEqual(parse(Scanner.parse_channel, result),
+                parse(parse_channel_regex, result), result)
@@ -0,0 +1,160 @@
+import os
+import stat
+import time
+import threading
+
+from bc125csv import main
+from bc125csv.cache import ChannelCache, DeviceCache, Journal, RateCache, \
+    replace_file
+from bc125csv.scanner import Channel, VirtualScanner
+from bc125csv.tests.base import BaseTestCase, mock
+
+
+class CacheTestCase(BaseTestCase):
+    def test_cache(self):
+        """
+        Save and load cached channels.
+        """
+        scanner = VirtualScanner()
+        channels = dict(zip(range(18, 22), scanner.get_channels(range(18, 22))))
+
+        cache = ChannelCache("VIRTUAL/1.0 test")
+        self.assertEqual(cache.load(), {})
+        cache.save(channels)
+        self.assertTrue(cache.filename.startswith(self.cachedir))
+        self.assertEqual(os.path.basename(cache.filename),
+            "VIRTUAL_1.0_test.channels")
+        self.assertEqual(cache.load(), channels)
+
+        # Saving keeps other cached channels
+        cache.save({18: None})
+        channels[18] = None
+        self.assertEqual(cache.load(), channels)
+
+        with open(cache.filename) as fh:
+            self.assertEqual(fh.read(), CACHE)
+        self.assertEqual(stat.S_IMODE(os.stat(cache.filename).st_mode), 0o600)
+
+    def test_cache_damaged(self):
+        """
+        Damaged lines in the cache are skipped.
+        """
+        cache = ChannelCache("damaged")
+        cache.save({})
+        with open(cache.filename, "w") as fh:
+            fh.write("DCH,1\nDCH\nCIN,2,garbage\nXYZ,3\n")
+        self.assertEqual(cache.load(), {1: None})
+
+    def test_journal(self):
+        """
+        Append channels to a journal and load them when resuming.
+        """
+        filename = os.path.join(self.cachedir, "test.journal")
+        channels = VirtualScanner().get_channels(range(18, 22))
+
+        journal = Journal(filename, "VIRTUAL")
+        self.assertEqual(journal.open(), {})
+        journal.record(zip(range(18, 20), channels))
+        journal.close()
+
+        # Interrupted while writing a line
+        with open(filename, "a") as fh:
+            fh.write("CIN,20,Chan")
+
+        journal = Journal(filename, "VIRTUAL")
+        self.assertEqual(journal.open(), dict(zip(range(18, 20), channels)))
+        journal.record(zip(range(20, 22), channels[2:]))
+        journal.close()
+        self.assertEqual(Journal(filename, "VIRTUAL").open(),
+            dict(zip(range(18, 22), channels)))
+
+        # Journal of another scanner is started over
+        journal = Journal(filename, "OTHER")
+        self.assertEqual(journal.open(), {})
+        journal.remove()
+        self.assertFalse(os.path.exists(filename))
+
+    def test_device(self):
+        """
+        Remember the last device path.
+        """
+        cache = DeviceCache()
+        self.assertEqual(cache.load(), None)
+        cache.save("/dev/ttyACM0")
+        self.assertEqual(cache.load(), "/dev/ttyACM0")
+
+    def test_rates(self):
+        """
+        Remember baud rates by device.
+        """
+        rates = RateCache()
+        self.assertEqual(rates.get("/dev/ttyACM0"), None)
+        rates.save("/dev/ttyACM0", 57600)
+        rates.save("serial 1", 115200)
+        self.assertEqual(rates.load(), {"/dev/ttyACM0": 57600, "serial 1": 115200})
+
+        with open(rates.filename, "a") as fh:
+            fh.write("damaged\nserial 2 fast\n")
+        rates.save("/dev/ttyACM0", 9600)
+        self.assertEqual(rates.load(), {"/dev/ttyACM0": 9600, "serial 1": 115200})
+
+    def test_rates_threads(self):
+        """
+        Rates saved at once by multiple devices are all kept.
+        """
+        def slow_replace_file(*args):
+            time.sleep(0.01)
+            replace_file(*args)
+
+        devices = ["/dev/ttyACM%d" % number for number in range(4)]
+        with mock.patch("bc125csv.cache.replace_file", slow_replace_file):
+            threads = [threading.Thread(target=RateCache().save,
+                args=(device, 57600)) for device in devices]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(RateCache().load(), dict.fromkeys(devices, 57600))
+
+    def test_export_cached(self):
+        """
+        Cached export only reads unknown channels.
+        """
+        # Without --cached the cache is not used at all
+        with mock.patch.object(VirtualScanner, "writeread",
+                autospec=True, side_effect=VirtualScanner.writeread) as writeread:
+            main(["export", "-n", "-b", "1"])
+        commands = [args[1] for args, _ in writeread.call_args_list]
+        self.assertNotIn("VER", commands)
+        self.assertEqual(os.listdir(self.cachedir), [])
+
+        main(["export", "-n", "-c", "-b", "1"])
+
+        with mock.patch.object(VirtualScanner, "writeread",
+                autospec=True, side_effect=VirtualScanner.writeread) as writeread:
+            main(["export", "-n", "-c", "-b", "1", "2"])
+        commands = [args[1] for args, _ in writeread.call_args_list]
+        self.assertNotIn("CIN,1", commands)
+        self.assertIn("CIN,51", commands)
+
+    def test_export_verify_sample(self):
+        """
+        Outdated cached channels are read again.
+        """
+        cache = ChannelCache("VIRTUAL-Version 1.00.00-virtual")
+        cache.save(dict((index, Channel(index, "Stale", "150.0000"))
+            for index in range(1, 51)))
+
+        with mock.patch.object(VirtualScanner, "writeread",
+                autospec=True, side_effect=VirtualScanner.writeread) as writeread:
+            main(["export", "-n", "-c", "--verify-sample", "5", "-b", "1"])
+        commands = [args[1] for args, _ in writeread.call_args_list]
+        self.assertEqual(len([c for c in commands if c.startswith("CIN,")]), 55)
+        self.assertEqual(cache.load()[1], VirtualScanner().get_channel(1))
+
+
+CACHE = """DCH,18
+CIN,19,Channel 19,01190000,FM,0,2,0,0
+DCH,20
+DCH,21
+"""
@@ -0,0 +1,143 @@
+import os
+import sys
+import stat
+import time
+import threading
+
+from bc125csv import main
+from bc125csv.daemon import get_socket_path, is_running
+from bc125csv.handler import Handler
+from bc125csv.tests.test_importer import IMPORT_ERRORS
+from bc125csv.tests.test_scanner import CommandRecordingScanner
+from bc125csv.tests.base import BaseTestCase, PseudoTTY, StringIO, mock, \
+    create_csv
+
+
+class DaemonTestCase(BaseTestCase):
+    def setUp(self):
+        super(DaemonTestCase, self).setUp()
+        self.path = os.path.join(self.cachedir, "daemon.sock")
+
+        # Stale socket file is replaced
+        open(self.path, "w").close()
+
+        handler = Handler(["serve", "-n", "--socket", self.path])
+        thread = threading.Thread(target=handler.command_serve)
+        self.scanner = CommandRecordingScanner()
+        with mock.patch("bc125csv.handler.VirtualScanner", lambda: self.scanner):
+            thread.start()
+            while not getattr(handler, "server", None):
+                time.sleep(0.01)
+
+        def stop():
+            handler.server.shutdown()
+            thread.join()
+        self.addCleanup(stop)
+
+    def test_socket_path(self):
+        self.assertEqual(stat.S_IMODE(os.stat(self.path).st_mode), 0o600)
+        self.assertEqual(get_socket_path(),
+            os.path.join(self.cachedir, "bc125csv.sock"))
+        with mock.patch.dict(os.environ, {"BC125CSV_SOCKET": self.path}):
+            self.assertEqual(get_socket_path(), self.path)
+            self.assertTrue(is_running(get_socket_path()))
+        self.assertFalse(is_running(get_socket_path()))
+
+    def test_export(self):
+        """
+        Export using the scanner of the daemon.
+        """
+        main(["export", "--socket", self.path, "-b", "1"])
+        self.assertIn("1,Channel 1,101.0000,FM", sys.stdout.getvalue())
+
+        # Output file relative to the working directory of the client
+        cwd = os.getcwd()
+        os.chdir(self.cachedir)
+        self.addCleanup(os.chdir, cwd)
+        main(["export", "--socket", self.path, "-o", "export.csv"])
+        with open(os.path.join(self.cachedir, "export.csv")) as fh:
+            self.assertIn("51,Channel 51,151.0000,FM", fh.read())
+
+    def test_retries(self):
+        """
+        Retries set for a command are used during it only.
+        """
+        retries = []
+        def export_channels(handler, scanner):
+            retries.append(scanner.retries)
+        with mock.patch.object(Handler, "export_channels", autospec=True,
+                side_effect=export_channels):
+            main(["export", "--socket", self.path, "--retries", "0"])
+            main(["export", "--socket", self.path])
+        self.assertEqual(retries, [0, 3])
+        self.assertEqual(self.scanner.retries, 3)
+
+    def test_import_errors(self):
+        """
+        Errors and exit code are passed on.
+        """
+        with mock.patch("sys.stdin", StringIO(IMPORT_ERRORS)):
+            with self.assertRaises(SystemExit) as cm:
+                main(["import", "--socket", self.path])
+        self.assertEqual(cm.exception.code,
+            "\nThere are errors in your csv data.")
+        self.assertIn("Error on line 5", sys.stderr.getvalue())
+
+    def test_state(self):
+        """
+        Channels changed on the keypad between requests are deleted.
+        """
+        filename = os.path.join(self.cachedir, "import.csv")
+        with open(filename, "w") as fh:
+            fh.write(create_csv(range(51, 60)))
+        main(["import", "--socket", self.path, "-b", "2", "-i", filename])
+        # Known to be empty
+        self.assertIn("CIN,60", self.scanner.commands)
+        self.assertNotIn("DCH,60", self.scanner.commands)
+
+        # Programmed on the keypad
+        self.scanner.memory[60] = "CIN,60,Keypad,01600000,FM,0,2,0,0"
+        del self.scanner.commands[:]
+        main(["import", "--socket", self.path, "-b", "2", "-i", filename])
+        self.assertIn("DCH,60", self.scanner.commands)
+
+    def test_exception(self):
+        """
+        Unexpected errors are answered with an exit code.
+        """
+        with mock.patch.object(Handler, "command_export",
+                side_effect=IOError("Disk full")):
+            with self.assertRaises(SystemExit) as cm:
+                main(["export", "--socket", self.path])
+        self.assertIn("Disk full", cm.exception.code)
+
+    def test_shell(self):
+        with mock.patch("sys.stdin", StringIO("MDL\n\nVER\n")):
+            with self.assertRaises(SystemExit) as cm:
+                main(["shell", "--socket", self.path])
+        self.assertEqual(cm.exception.code, None)
+        self.assertStdOut("MDL,VIRTUAL\nVER,Version 1.00.00")
+
+        sys.stdout = StringIO()
+        with mock.patch("sys.stdin", PseudoTTY(StringIO("MDL\nVER\n"))):
+            with self.assertRaises(SystemExit) as cm:
+                main(["shell", "--socket", self.path])
+        self.assertIn("< MDL,VIRTUAL", sys.stdout.getvalue())
+        self.assertIn("< VER,Version 1.00.00", sys.stdout.getvalue())
+
+    def test_batch(self):
+        with mock.patch("sys.stdin", StringIO("export -b 2\nexport -b 2\n")):
+            main(["batch", "--socket", self.path])
+        self.assertEqual(sys.stdout.getvalue().count("51,Channel 51"), 2)
+
+    def test_errors(self):
+        with self.assertRaises(SystemExit) as cm:
+            main(["serve", "-n", "--socket", self.path])
+        self.assertEqual(cm.exception.code,
+            "A daemon is already running on %s." % self.path)
+
+        path = os.path.join(self.cachedir, "missing.sock")
+        with self.assertRaises(SystemExit) as cm:
+            main(["export", "--socket", path])
+        self.assertEqual(cm.exception.code,
+            "Could not connect to daemon on %s." % path)
@@ -1,7 +1,19 @@
+import os
+import sys
+import shutil
+import tempfile
+
+import serial
+
 from bc125csv import main
-from bc125csv.handler import VERSION
+from bc125csv.handler import Handler, VERSION
+from bc125csv.cache import DeviceCache, RateCache
+from bc125csv.scanner import ScannerException, VirtualScanner
+from bc125csv.tests.test_scanner import CommandRecordingScanner, \
+    FlakyScanner, RateLimitedScanner
 from bc125csv.tests.test_importer import IMPORT, IMPORT_ERRORS
-from bc125csv.tests.base import BaseTestCase, PseudoTTY, StringIO, mock, builtins
+from bc125csv.tests.base import BaseTestCase, PseudoTTY, StringIO, mock, \
+    builtins, create_csv
 
 from bc125csv.tests.base import unittest
 
@@ -76,6 +88,84 @@ class HandlerTestCase(BaseTestCase):
             self.assertStdErr("")
             self.assertNotEqual(cm.exception.code, None)
 
+    def create_files(self, **files):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        for name, data in files.items():
+            with open(os.path.join(directory, name), "w") as fh:
+                fh.write(data)
+        return directory
+
+    def test_verify_files(self):
+        """
+        Verify multiple csv files in parallel.
+        """
+        directory = self.create_files(**{"a.csv": IMPORT, "b.csv": IMPORT,
+            "c.txt": IMPORT_ERRORS})
+        for jobs in ("1", "2"):
+            with self.assertRaises(SystemExit) as cm:
+                main(["verify", "-j", jobs, "-i", os.path.join(directory, "*.csv")])
+            self.assertEqual(cm.exception.code, None)
+
+        report = sys.stderr.getvalue().replace(directory + os.sep, "")
+        self.assertIn("a.csv: 15 channels, 0 errors", report)
+        self.assertIn("b.csv: 15 channels, 0 errors", report)
+        self.assertIn("Verified 2 files in", report)
+
+    def test_verify_files_errors(self):
+        """
+        Verify multiple csv files with errors.
+        """
+        directory = self.create_files(**{"a.csv": IMPORT, "b.csv": IMPORT_ERRORS})
+        with self.assertRaises(SystemExit) as cm:
+            main(["verify", "-i", os.path.join(directory, "a.csv"),
+                "-i", os.path.join(directory, "b.csv")])
+        self.assertNotEqual(cm.exception.code, None)
+
+        report = sys.stderr.getvalue().replace(directory + os.sep, "")
+        self.assertIn("Error in b.csv on line 5: Invalid name: Wrong chars~~~.",
+            report)
+        self.assertIn("b.csv: 2 channels, 12 errors", report)
+        self.assertIn(": 12 errors.", report)
+
+        # Missing files
+        with self.assertRaises(SystemExit) as cm:
+            main(["verify", "-i", os.path.join(directory, "a.csv"),
+                "-i", os.path.join(directory, "*.txt")])
+        self.assertNotEqual(cm.exception.code, None)
+
+        # Only a single file can be imported
+        with self.assertRaises(SystemExit) as cm:
+            main(["import", "-n", "-i", os.path.join(directory, "*.csv")])
+        self.assertEqual(cm.exception.code, "Only one input file can be read.")
+
+    def test_verify_files_unreadable(self):
+        """
+        Files that can not be read fail, the others are still verified.
+        """
+        directory = self.create_files(**{"a.csv": IMPORT})
+        with open(os.path.join(directory, "b.csv"), "wb") as fh:
+            fh.write(b"Channel,Name\n1,\xff\xfe\n")
+        os.mkdir(os.path.join(directory, "c.csv"))
+
+        with mock.patch("os.path.isfile", return_value=True):
+            with self.assertRaises(SystemExit) as cm:
+                main(["verify", "-j", "1", "-i", os.path.join(directory, "*")])
+        self.assertNotEqual(cm.exception.code, None)
+
+        report = sys.stderr.getvalue().replace(directory + os.sep, "")
+        self.assertIn("a.csv: 15 channels, 0 errors", report)
+        if sys.version_info[0] >= 3:
+            # Python 2 reads bytes without decoding
+            self.assertIn("Error in b.csv: Could not read file: ", report)
+        self.assertIn("Error in c.csv: Could not read file: ", report)
+        self.assertIn("Verified 3 files in", report)
+
+    def test_input_before_action(self):
+        handler = Handler(["-i", "a.csv", "import"])
+        self.assertEqual(handler.params.command, "import")
+        self.assertEqual(handler.get_input_files(), ["a.csv"])
+
     #@unittest.skipIf(sys.version_info[0] < 3, 'Python 3')
     def test_shell(self):
         """
@@ -91,6 +181,299 @@ class HandlerTestCase(BaseTestCase):
                 main(["shell", "-n"])
             self.assertEqual(cm.exception.code, None)
 
+    def test_rate_auto(self):
+        """
+        Probe for the fastest baud rate and remember it.
+        """
+        main(["export", "-n", "-r", "auto"])
+        self.assertEqual(RateCache().get("virtual"), 115200)
+
+        handler = Handler(["export", "-r", "auto"])
+        handler.serial_number = "ttyACM0"
+        scanner = RateLimitedScanner(19200)
+        handler.select_rate(scanner)
+        self.assertEqual(RateCache().get("ttyACM0"), 19200)
+
+        # Short timeout only while probing
+        self.assertEqual(set(scanner.timeouts), set([1]))
+        self.assertEqual(scanner.timeout, None)
+
+        # Remembered rate is used while it works
+        scanner = RateLimitedScanner(19200)
+        handler.select_rate(scanner)
+        self.assertEqual(scanner.rates, [19200])
+
+        scanner = RateLimitedScanner(9600)
+        handler.select_rate(scanner)
+        self.assertEqual(RateCache().get("ttyACM0"), 9600)
+
+        with self.assertRaises(SystemExit):
+            handler.select_rate(RateLimitedScanner(2400))
+
+        with self.assertRaises(SystemExit):
+            main(["export", "-n", "-r", "fast"])
+        with self.assertRaises(SystemExit):
+            main(["export", "-n", "-r", "1200"])
+
+    def test_find_device(self):
+        """
+        Find a device, trying the last device found first.
+        """
+        device = {"DEVNAME": "/dev/ttyACM0", "SUBSYSTEM": "tty"}
+        lookup = mock.Mock()
+        lookup.get_device.return_value = device
+        lookup.get_device_by_path.return_value = None
+
+        handler = Handler(["export"])
+        self.assertEqual(handler.find_device(lookup), device)
+        self.assertEqual(DeviceCache().load(), "/dev/ttyACM0")
+
+        lookup.reset_mock()
+        lookup.get_device_by_path.return_value = device
+        self.assertEqual(handler.find_device(lookup), device)
+        lookup.get_device_by_path.assert_called_once_with("/dev/ttyACM0")
+        self.assertFalse(lookup.get_device.called)
+
+        # Device without tty is not remembered
+        DeviceCache().save("/dev/ttyACM1")
+        lookup.get_device_by_path.return_value = None
+        lookup.get_device.return_value = {"SUBSYSTEM": "usb"}
+        lookup.is_tty.return_value = False
+        self.assertEqual(handler.find_device(lookup), {"SUBSYSTEM": "usb"})
+        self.assertEqual(DeviceCache().load(), "/dev/ttyACM1")
+
+    def test_journal(self):
+        """
+        Resume an interrupted import and export.
+        """
+        journal = os.path.join(self.cachedir, "import.journal")
+        filename = os.path.join(self.cachedir, "import.csv")
+        with open(filename, "w") as fh:
+            fh.write(create_csv(indexes=range(1, 51)))
+
+        class FailingScanner(CommandRecordingScanner):
+            def writeread(self, command):
+                if command.startswith("CIN,30,"):
+                    return "ERR"
+                return super(FailingScanner, self).writeread(command)
+
+        # Failure in the second batch of writes
+        with mock.patch("bc125csv.handler.VirtualScanner", FailingScanner):
+            with self.assertRaises(ScannerException):
+                main(["import", "-n", "-b", "1", "--journal", journal,
+                    "-i", filename])
+        with open(journal) as fh:
+            self.assertEqual(len(fh.readlines()), 26)
+
+        scanner = CommandRecordingScanner()
+        with mock.patch("bc125csv.handler.VirtualScanner", lambda: scanner):
+            main(["import", "-n", "-b", "1", "--journal", journal, "-i", filename])
+        written = [int(command.split(",")[1]) for command in scanner.commands
+            if command.startswith("CIN,")]
+        self.assertEqual(written, list(range(26, 51)))
+        self.assertFalse(os.path.exists(journal))
+
+        # Export reads channels not in the journal
+        with open(journal, "w") as fh:
+            fh.write("# VIRTUAL-Version 1.00.00-virtual\n")
+            fh.write("CIN,1,Journaled,01500000,FM,0,2,0,0\nDCH,2\n")
+
+        scanner = CommandRecordingScanner()
+        with mock.patch("bc125csv.handler.VirtualScanner", lambda: scanner):
+            main(["export", "-n", "-b", "1", "--journal", journal])
+        self.assertNotIn("CIN,1", scanner.commands)
+        self.assertNotIn("CIN,2", scanner.commands)
+        self.assertIn("CIN,3", scanner.commands)
+        self.assertIn("1,Journaled,150.0000", sys.stdout.getvalue())
+        self.assertNotIn("2,Channel 2", sys.stdout.getvalue())
+        self.assertFalse(os.path.exists(journal))
+
+    def test_journal_closed(self):
+        """
+        The journal is closed and kept when the import fails.
+        """
+        journal = os.path.join(self.cachedir, "import.journal")
+
+        class FailingScanner(VirtualScanner):
+            def writeread(self, command):
+                if command.startswith("DCH,"):
+                    return "ERR"
+                return super(FailingScanner, self).writeread(command)
+
+        handler = Handler(["import", "-n", "-b", "1", "--journal", journal])
+        with mock.patch("sys.stdin", StringIO(IMPORT)):
+            with mock.patch("bc125csv.handler.VirtualScanner", FailingScanner):
+                with self.assertRaises(ScannerException):
+                    handler.handle()
+        self.assertTrue(handler.journal.fh.closed)
+        self.assertTrue(os.path.exists(journal))
+
+    def test_retries(self):
+        """
+        Retried commands are reported.
+        """
+        with mock.patch("sys.stdin", StringIO(IMPORT)):
+            with mock.patch("bc125csv.handler.VirtualScanner", FlakyScanner):
+                with mock.patch("time.sleep"):
+                    with self.assertRaises(ScannerException):
+                        main(["import", "-n", "-v", "-b", "1"])
+        self.assertIn("Retried CIN 50 times", sys.stderr.getvalue())
+        self.assertIn("Retry budget used up", sys.stderr.getvalue())
+
+        sys.stderr = StringIO()
+        with mock.patch("sys.stdin", StringIO(IMPORT)):
+            with mock.patch("bc125csv.handler.VirtualScanner", FlakyScanner):
+                with mock.patch.object(FlakyScanner, "RETRY_BUDGET", 100):
+                    with mock.patch("time.sleep"):
+                        main(["import", "-n", "-v", "-b", "1"])
+        self.assertIn("Retried CIN 50 times, DCH", sys.stderr.getvalue())
+        self.assertNotIn("Retry budget used up", sys.stderr.getvalue())
+
+    def test_batch(self):
+        """
+        Run steps in one programming session.
+        """
+        path = lambda name: os.path.join(self.cachedir, name)
+        with open(path("script.txt"), "w") as fh:
+            fh.write("export -b 2 -o '%s'\n" % path("backup.csv"))
+            fh.write("import -b 2 -d -i '%s'\n\n" % path("backup.csv"))
+            fh.write("# Check the result\n")
+            fh.write("verify -i '%s'\n" % path("backup.csv"))
+            fh.write("export -b 2 -o '%s' # again\n" % path("result.csv"))
+
+        scanner = CommandRecordingScanner()
+        with mock.patch("bc125csv.handler.VirtualScanner", lambda: scanner):
+            main(["batch", "-n", "-i", path("script.txt")])
+        self.assertEqual(scanner.commands.count("PRG"), 1)
+        self.assertEqual(scanner.commands.count("EPG"), 1)
+        self.assertEqual(scanner.commands[-1], "EPG")
+        with open(path("backup.csv")) as backup, open(path("result.csv")) as result:
+            data = backup.read()
+            self.assertIn("51,Channel 51", data)
+            self.assertEqual(data, result.read())
+
+    def test_batch_retries(self):
+        """
+        Steps use the retries of the batch unless they set their own.
+        """
+        retries = []
+        def export_channels(handler, scanner):
+            retries.append(scanner.retries)
+        with mock.patch.object(Handler, "export_channels", autospec=True,
+                side_effect=export_channels):
+            with mock.patch("sys.stdin",
+                    StringIO("export --retries 0\nexport\n")):
+                main(["batch", "-n", "--retries", "5"])
+        self.assertEqual(retries, [0, 5])
+
+    def test_batch_errors(self):
+        """
+        Steps are checked before running and the batch stops on failures.
+        """
+        for script, error in (
+                ("export\nshell\n", "Unsupported step on line 2: shell"),
+                ("-n batch\n", "Unsupported step on line 1: batch"),
+                ("serve --socket x\n", "Unsupported step on line 1: serve"),
+                ("export -b 1\nexport -a\n",
+                    "Step on line 2 can not use all devices."),
+                ("export --unknown\n", "Invalid step on line 1."),
+                ("import -b 1\n", "Step on line 1 needs an input file.")):
+            with mock.patch("sys.stdin", StringIO(script)):
+                with self.assertRaises(SystemExit) as cm:
+                    main(["batch", "-n"])
+            self.assertEqual(cm.exception.code, error)
+
+        filename = os.path.join(self.cachedir, "errors.csv")
+        with open(filename, "w") as fh:
+            fh.write(IMPORT_ERRORS)
+
+        scanner = CommandRecordingScanner()
+        with mock.patch("sys.stdin", StringIO("export\nimport -i %s\nexport\n"
+                % filename)):
+            with mock.patch("bc125csv.handler.VirtualScanner", lambda: scanner):
+                with self.assertRaises(SystemExit) as cm:
+                    main(["batch", "-n"])
+        self.assertEqual(cm.exception.code, "Batch failed on line 2.")
+        self.assertEqual(scanner.commands[-1], "EPG")
+
+    def test_all_devices_import(self):
+        """
+        Import into all devices.
+        """
+        devices = [{"DEVNAME": "/dev/ttyACM0"}, {"DEVNAME": "/dev/ttyACM1"}]
+        with mock.patch.object(Handler, "get_devices", return_value=devices):
+            with mock.patch.object(VirtualScanner, "set_channels") as set_channels:
+                with mock.patch("sys.stdin", StringIO(IMPORT)):
+                    main(["import", "-n", "-a", "-v", "-b", "1"])
+        self.assertEqual(set_channels.call_count, 2)
+        self.assertIn("[ttyACM0] Done", sys.stderr.getvalue())
+        self.assertIn("[ttyACM1] Done", sys.stderr.getvalue())
+
+    def test_all_devices_export(self):
+        """
+        Export from all devices to separate files.
+        """
+        devices = [{"DEVNAME": "/dev/ttyACM0"}, {"DEVNAME": "/dev/ttyACM1"}]
+        with mock.patch.object(Handler, "get_devices", return_value=devices):
+            with mock.patch.object(builtins, "open", mock.mock_open()) as mocked:
+                main(["export", "-n", "-a", "-o", "backup.csv"])
+        filenames = sorted(args[0] for args, _ in mocked.call_args_list
+            if args[0].startswith("backup"))
+        self.assertEqual(filenames, ["backup-ttyACM0.csv", "backup-ttyACM1.csv"])
+
+        # Export requires an output file
+        with mock.patch.object(Handler, "get_devices", return_value=devices):
+            with self.assertRaises(SystemExit) as cm:
+                main(["export", "-n", "-a"])
+            self.assertNotEqual(cm.exception.code, None)
+
+    def test_all_devices_errors(self):
+        """
+        Failing devices are reported.
+        """
+        class FailingScanner(VirtualScanner):
+            def writeread(self, command):
+                if command.startswith("DCH,"):
+                    return "ERR"
+                return super(FailingScanner, self).writeread(command)
+
+        devices = [{"DEVNAME": "/dev/ttyACM0"}]
+        with mock.patch.object(Handler, "get_devices", return_value=devices):
+            with mock.patch("bc125csv.handler.VirtualScanner", FailingScanner):
+                with mock.patch("sys.stdin", StringIO(IMPORT)):
+                    with self.assertRaises(SystemExit) as cm:
+                        main(["import", "-n", "-a", "-b", "1"])
+        self.assertEqual(cm.exception.code, "Failed on 1 of 1 devices.")
+        self.assertStdErr("ttyACM0: Could not delete channel 16.")
+
+        with mock.patch.object(Handler, "get_devices", return_value=[]):
+            with self.assertRaises(SystemExit) as cm:
+                main(["export", "-n", "-a", "-o", "backup.csv"])
+            self.assertNotEqual(cm.exception.code, None)
+
+    def test_all_devices_serial_error(self):
+        """
+        Serial port errors fail the device, leaving programming mode.
+        """
+        class DisconnectedScanner(CommandRecordingScanner):
+            def writeread(self, command):
+                if command.startswith("CIN,1,"):
+                    raise serial.SerialException("Device disconnected.")
+                return super(DisconnectedScanner, self).writeread(command)
+
+        failing, working = DisconnectedScanner(), CommandRecordingScanner()
+        devices = [{"DEVNAME": "/dev/ttyACM0"}, {"DEVNAME": "/dev/ttyACM1"}]
+        with mock.patch.object(Handler, "get_devices", return_value=devices):
+            with mock.patch("bc125csv.handler.VirtualScanner",
+                    side_effect=[failing, working]):
+                with mock.patch("sys.stdin", StringIO(IMPORT)):
+                    with self.assertRaises(SystemExit) as cm:
+                        main(["import", "-n", "-a", "-b", "1"])
+        self.assertEqual(cm.exception.code, "Failed on 1 of 2 devices.")
+        self.assertIn("Device disconnected.", sys.stderr.getvalue())
+        self.assertEqual(failing.commands[-1], "EPG")
+        self.assertEqual(working.commands[-1], "EPG")
+
 ERROR_LINES = """Error on line 5: Invalid name: Wrong chars~~~.
 Error on line 8: Invalid frequency: 100.999x.
 Error on line 9: Invalid frequency: -100.000.
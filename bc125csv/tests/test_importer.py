@@ -1,5 +1,8 @@
 from bc125csv import main
+from bc125csv.importer import Importer, ParseError
+from bc125csv.scanner import VirtualScanner
 from bc125csv.tests.base import BaseTestCase, PseudoTTY, StringIO, mock, builtins
+from bc125csv.tests.test_scanner import CommandRecordingScanner
 
 
 class ImporterTestCase(BaseTestCase):
@@ -11,6 +14,68 @@ class ImporterTestCase(BaseTestCase):
             with mock.patch.object(builtins, 'open', return_value=StringIO(IMPORT)):
                 main(["import", "-n", "-b", "1", "-i", "import.csv"])
 
+    def test_import_diff(self):
+        """
+        Import into bank 1, only writing changed channels.
+        """
+        with mock.patch("sys.stdin", StringIO(IMPORT_DIFF)):
+            with mock.patch.object(VirtualScanner, "set_channels") as set_channels:
+                with mock.patch.object(VirtualScanner, "delete_channels") as delete_channels:
+                    main(["import", "-n", "-d", "-b", "1"])
+
+        # Channel 11 is unchanged, channel 12 was renamed
+        written = set_channels.call_args[0][0]
+        self.assertEqual([channel.index for channel in written], [12])
+
+        # Channels 1-10 and 13-19 are not in the import data
+        deleted = delete_channels.call_args[0][0]
+        self.assertEqual(deleted, list(range(1, 11)) + list(range(13, 20)))
+
+    def test_import_verify(self):
+        """
+        Import into bank 1, reading back the written and deleted channels.
+        """
+        with mock.patch("sys.stdin", StringIO(IMPORT_DIFF)):
+            with mock.patch.object(VirtualScanner, "get_channels",
+                    autospec=True, side_effect=VirtualScanner.get_channels) \
+                    as get_channels:
+                main(["import", "-n", "-d", "--verify", "-b", "1"])
+
+        # Only the written and deleted channels are read back
+        self.assertEqual(get_channels.call_args[0][1],
+            list(range(1, 11)) + list(range(12, 20)))
+
+        # Scanner ignoring writes to channel 12
+        class IgnoringScanner(VirtualScanner):
+            def writeread(self, command):
+                if command.startswith("CIN,12,"):
+                    return "CIN,OK"
+                return super(IgnoringScanner, self).writeread(command)
+
+        with mock.patch("sys.stdin", StringIO(IMPORT_DIFF)):
+            with mock.patch("bc125csv.handler.VirtualScanner", IgnoringScanner):
+                with self.assertRaises(SystemExit) as cm:
+                    main(["import", "-n", "-d", "--verify", "-b", "1"])
+        self.assertEqual(cm.exception.code, "Verification failed for 1 channels.")
+        self.assertStdErr("Channel 12 was not written correctly.")
+
+    def test_import_long_names(self):
+        """
+        Names cut to 16 characters by the scanner verify and compare equal.
+        """
+        scanner = CommandRecordingScanner()
+        with mock.patch("bc125csv.handler.VirtualScanner", lambda: scanner):
+            with mock.patch("sys.stdin", StringIO(IMPORT_LONG_NAMES)):
+                main(["import", "-n", "--verify", "-b", "2"])
+            self.assertIn("CIN,51,A rather long ch,01510000,FM,0,2,0,0",
+                scanner.commands)
+
+            del scanner.commands[:]
+            with mock.patch("sys.stdin", StringIO(IMPORT_LONG_NAMES)):
+                main(["import", "-n", "-d", "--verify", "-b", "2"])
+            self.assertFalse([command for command in scanner.commands
+                if command.startswith("CIN,51,")])
+
     def test_import_errors(self):
         """
         Invalid import into bank 2.
@@ -37,62 +102,139 @@ class ImporterTestCase(BaseTestCase):
         with mock.patch("sys.stdin", StringIO(IMPORT)):
             main(["import", "-n"])
 
+class ParseTestCase(BaseTestCase):
+    def test_parse_tqcode(self):
+        """
+        CTCSS tone and DCS code notations.
+        """
+        importer = Importer(StringIO(""))
+        notations = {
+            0: (None, "", "none", "None", "all"),
+            127: ("search",),
+            240: ("notone", "no tone"),
+            80: ("114.8", "114.8Hz", "114.8 Hz", "CTCSS 114.8 Hz",
+                "ctcss114.8", "CTCSS  114.8  HZ"),
+            64: ("67.0", "067.0", "67.0hz"),
+            130: ("26", "026", "DCS026", "DCS 026", "dcs  26"),
+        }
+        for code, values in notations.items():
+            for value in values:
+                self.assertEqual(importer.parse_tqcode(value), code, value)
+
+        for value in ("67", "114.9", "DCS 027", "CTCSS", "1 14.8"):
+            with self.assertRaises(ParseError):
+                importer.parse_tqcode(value)
+
+    def test_parse_row(self):
+        """
+        Rows with missing, empty and additional columns.
+        """
+        importer = Importer(StringIO(""))
+        channel = importer.parse_row(["1", "", "150"])
+        self.assertEqual((channel.name, channel.modulation, channel.tqcode,
+            channel.delay, channel.lockout, channel.priority),
+            ("", "AUTO", 0, 2, False, False))
+
+        channel = importer.parse_row(["500", "Name", "150.5", "nfm", "dcs 26",
+            "+3", "YES", "True", "additional", "columns"])
+        self.assertEqual((channel.index, channel.name, channel.modulation,
+            channel.tqcode, channel.delay, channel.lockout, channel.priority),
+            (500, "Name", "NFM", 130, 3, True, True))
+
+        for row in (["0", "", "150"], ["1", "Name,", "150"], ["1", "", "100"],
+                ["1", "", "150.0020"],
+                ["1", "", "150", "", "", "-3"]):
+            with self.assertRaises(ParseError):
+                importer.parse_row(row)
+
+    def test_iter_channels(self):
+        """
+        Channels and errors are yielded while reading.
+        """
+        importer = Importer(StringIO(IMPORT_ERRORS))
+        items = list(importer.iter_channels())
+
+        errors = [item for item in items if isinstance(item, ParseError)]
+        self.assertEqual([err.line for err in errors],
+            [5, 8, 9, 11, 13, 15, 16, 19, 21, 24, 25, 26])
+        self.assertEqual(str(errors[-1]), "Channel 1 was seen before.")
+
+        channels = [item for item in items if not isinstance(item, ParseError)]
+        self.assertEqual([channel.index for channel in channels], [1, 10])
+
+        # Nothing is read before iterating
+        data = StringIO(IMPORT)
+        generator = Importer(data).iter_channels()
+        self.assertEqual(data.tell(), 0)
+        self.assertEqual(next(generator).index, 1)
+
+
 IMPORT = """Channel,Name,Frequency,Modulation,CTCSS/DCS,Delay,Lockout,Priority
 #Channel,Name,Frequency,Modulation,CTCSS/DCS,Delay,Lockout,Priority
 
 # Bank 1
-1,Channel Name,100.0000
+1,Channel Name,150.0000
 
 # Modulations
-2,Channel Name,100.0000,AUTO
-3,Channel Name,100.0000,FM
-4,Channel Name,100.0000,NFM
-5,Channel Name,100.0000,AM
+2,Channel Name,150.0000,AUTO
+3,Channel Name,150.0000,FM
+4,Channel Name,150.0000,NFM
+5,Channel Name,150.0000,AM
 
 # TQ
-6,Channel Name,100.0000,,none
-7,Channel Name,100.0000,,DCS 261,2
-8,Channel Name,100.0000,,search
-9,Channel Name,100.0000,,no tone
-10,Channel Name,100.0000,,CTCSS 136.5 Hz
+6,Channel Name,150.0000,,none
+7,Channel Name,150.0000,,DCS 261,2
+8,Channel Name,150.0000,,search
+9,Channel Name,150.0000,,no tone
+10,Channel Name,150.0000,,CTCSS 136.5 Hz
 
 # Delay
-11,Channel Name,100.0000,,,2
+11,Channel Name,150.0000,,,2
 
 # Lockout
-12,Channel Name,100.0000,,,,yes
-13,Channel Name,100.0000,,,,no
+12,Channel Name,150.0000,,,,yes
+13,Channel Name,150.0000,,,,no
 
 # Priority
-14,Channel Name,100.0000,,,,,yes
-15,Channel Name,100.0000,,,,,no
+14,Channel Name,150.0000,,,,,yes
+15,Channel Name,150.0000,,,,,no
+"""
+
+IMPORT_DIFF = """Channel,Name,Frequency,Modulation,CTCSS/DCS,Delay,Lockout,Priority
+11,Channel 11,111.0000,FM,none,2,no,no
+12,Renamed,112.0000,FM,none,2,no,no
+"""
+
+IMPORT_LONG_NAMES = """Channel,Name,Frequency,Modulation,CTCSS/DCS,Delay,Lockout,Priority
+51,A rather long channel name,151.0000,FM,none,2,no,no
 """
 
 IMPORT_ERRORS = """Channel,Name,Frequency,Modulation,CTCSS/DCS,Delay,Lockout,Priority
 
 # Name
-1,Channel name too long,100.0000
-2,Wrong chars~~~,100.0000
+1,Channel name too long,150.0000
+2,Wrong chars~~~,150.0000
 
 # Frequency
 3,Channel name,100.999x
 3,Channel name,-100.000
 # Modulation
-4,Channel name,100.0000,XM
+4,Channel name,150.0000,XM
 # TQ
-5,Channel name,100.0000,,error
+5,Channel name,150.0000,,error
 # Delay
-6,Channel name,100.0000,,,99
-7,Channel name,100.0000,,,error
+6,Channel name,150.0000,,,99
+7,Channel name,150.0000,,,error
 
 # Lockout
-8,Channel name,100.0000,,,,error
+8,Channel name,150.0000,,,,error
 # Priority
-9,Channel name,100.0000,,,,,error
+9,Channel name,150.0000,,,,,error
 
 # Channel
-error,Channel name,100.0000
-1000,Channel name,100.0000
-1,Duplicate index,100.0000
-10,,100.0000
+error,Channel name,150.0000
+1000,Channel name,150.0000
+1,Duplicate index,150.0000
+10,,150.0000
 """
+
@@ -0,0 +1,125 @@
+import os
+import stat
+
+from bc125csv import main
+from bc125csv.handler import Handler
+from bc125csv.observer import Observer, PrometheusObserver
+from bc125csv.scanner import ScannerException, VirtualScanner
+from bc125csv.tests.base import BaseTestCase, mock
+from bc125csv.tests.test_scanner import ChunkedScanner, FlakyScanner
+
+
+class RecordingObserver(Observer):
+    """Observer keeping track of all events."""
+    def __init__(self):
+        self.events = []
+
+    def command(self, command, response):
+        self.events.append(("command", command, response))
+
+    def retry(self, command):
+        self.events.append(("retry", command))
+
+    def span_started(self, name):
+        self.events.append(("start", name))
+
+    def span_ended(self, name, seconds, error):
+        self.events.append(("end", name, type(error).__name__ if error else None))
+
+
+class ObserverTestCase(BaseTestCase):
+    def test_scanner(self):
+        scanner = FlakyScanner()
+        scanner.retry_delay = 0
+        scanner.retries = 1
+        observer = scanner.observer = RecordingObserver()
+
+        self.assertEqual(scanner.send("MDL"), "MDL,VIRTUAL")
+        scanner.get_channels([1, 2])
+        self.assertEqual(observer.events, [
+            ("command", "MDL", "MDL,VIRTUAL"),
+            ("command", "CIN,1", "ERR"),
+            ("command", "CIN,2", "ERR"),
+            ("retry", "CIN,1"),
+            ("command", "CIN,1", scanner.writeread("CIN,1")),
+            ("retry", "CIN,2"),
+            ("command", "CIN,2", scanner.writeread("CIN,2")),
+        ])
+
+        # No response
+        scanner = ChunkedScanner(b"", 1)
+        scanner.writecommand = scanner.flush = lambda *args: None
+        observer = scanner.observer = RecordingObserver()
+        with self.assertRaises(ScannerException):
+            scanner.send("MDL")
+        self.assertEqual(observer.events, [("command", "MDL", None)])
+
+    def test_handler(self):
+        """
+        Spans around operations and programming sessions.
+        """
+        observer = RecordingObserver()
+        scanner = VirtualScanner()
+        with mock.patch("bc125csv.handler.VirtualScanner", lambda: scanner):
+            Handler(["export", "-n", "-b", "2"], observer).handle()
+        spans = [event for event in observer.events if event[0] != "command"]
+        self.assertEqual(spans, [("start", "export"), ("start", "programming"),
+            ("end", "programming", None), ("end", "export", None)])
+        self.assertEqual(len(observer.events), 56)
+        self.assertIsNone(scanner.observer)
+
+    def test_metrics(self):
+        filename = os.path.join(self.cachedir, "metrics", "bc125csv.prom")
+        main(["export", "-n", "-b", "2", "--metrics", filename])
+        with open(filename) as fh:
+            metrics = fh.read()
+        self.assertIn("# TYPE bc125csv_commands_total counter\n", metrics)
+        self.assertIn('bc125csv_commands_total{command="CIN read"} 50\n', metrics)
+        self.assertIn('bc125csv_spans_total{span="export"} 1\n', metrics)
+        self.assertIn('bc125csv_spans_total{span="programming"} 1\n', metrics)
+        self.assertNotIn("bc125csv_errors_total{", metrics)
+        umask = os.umask(0o022)
+        try:
+            main(["export", "-n", "-b", "2", "--metrics", filename])
+        finally:
+            os.umask(umask)
+        self.assertEqual(stat.S_IMODE(os.stat(filename).st_mode), 0o644)
+
+        # Counters add up over commands
+        observer = PrometheusObserver(filename)
+        with mock.patch("bc125csv.handler.VirtualScanner", FlakyScanner):
+            for _ in range(2):
+                with self.assertRaises(ScannerException):
+                    Handler(["export", "-n", "-b", "2", "--retries", "0"],
+                        observer).handle()
+        metrics = observer.format()
+        self.assertIn('bc125csv_spans_total{span="export"} 2\n', metrics)
+        self.assertIn('bc125csv_span_failures_total{span="export"} 2\n', metrics)
+        self.assertIn('bc125csv_errors_total{command="CIN read"} 100\n', metrics)
+        self.assertIn('bc125csv_bytes_total{direction="sent"}', metrics)
+        with open(filename) as fh:
+            self.assertEqual(fh.read(), metrics)
+
+    def test_metrics_all_devices(self):
+        """
+        Counters are labelled by device and written once all are done.
+        """
+        filename = os.path.join(self.cachedir, "bc125csv.prom")
+        devices = [{"DEVNAME": "/dev/ttyACM0"}, {"DEVNAME": "/dev/ttyACM1"}]
+        with mock.patch.object(Handler, "get_devices", return_value=devices):
+            with mock.patch.object(PrometheusObserver, "write",
+                    autospec=True, side_effect=PrometheusObserver.write) \
+                    as write:
+                main(["export", "-n", "-a", "-b", "2", "-o",
+                    os.path.join(self.cachedir, "backup.csv"),
+                    "--metrics", filename])
+        self.assertEqual(write.call_count, 1)
+
+        with open(filename) as fh:
+            metrics = fh.read()
+        for device in ("ttyACM0", "ttyACM1"):
+            self.assertIn('bc125csv_commands_total{device="%s",'
+                'command="CIN read"} 50\n' % device, metrics)
+            self.assertIn('bc125csv_spans_total{device="%s",span="export"} 1\n'
+                % device, metrics)
+        self.assertIn('bc125csv_spans_total{span="all devices"} 1\n', metrics)
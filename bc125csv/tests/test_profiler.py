@@ -0,0 +1,111 @@
+from __future__ import division
+
+import os
+import sys
+import json
+
+from bc125csv import main
+from bc125csv.handler import Handler
+from bc125csv.profiler import BUCKETS, Profiler, get_kind, percentile
+from bc125csv.scanner import VirtualScanner
+from bc125csv.tests.base import BaseTestCase, StringIO, create_csv, mock
+from bc125csv.tests.test_scanner import ChunkedScanner
+
+
+class ProfilerTestCase(BaseTestCase):
+    def test_get_kind(self):
+        self.assertEqual(get_kind("CIN,1"), "CIN read")
+        self.assertEqual(get_kind("CIN,1,Name,01010000,FM,0,2,0,0"),
+            "CIN write")
+        self.assertEqual(get_kind("DCH,1"), "DCH")
+        self.assertEqual(get_kind("PRG"), "PRG")
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertEqual(percentile(values, 100), 100)
+        self.assertEqual(percentile([5], 50), 5)
+
+    def test_send(self):
+        scanner = VirtualScanner()
+        profiler = scanner.profiler = Profiler()
+        with scanner.programming():
+            scanner.get_channel(1)
+            scanner.get_channels(range(2, 12))
+            scanner.delete_channels([1])
+
+        commands = [record.command for record in profiler.records]
+        self.assertEqual(commands[0], "PRG")
+        self.assertEqual(commands[-1], "EPG")
+        self.assertEqual(commands[1:12], ["CIN,%d" % index
+            for index in range(1, 12)])
+        self.assertEqual(profiler.records[1].response[:6], "CIN,1,")
+        self.assertFalse(profiler.pending)
+
+        for record in profiler.records:
+            self.assertTrue(record.write <= record.written <= record.flushed)
+            self.assertTrue(record.first <= record.last)
+            self.assertTrue(record.latency >= 0)
+
+        summary = profiler.summary()
+        self.assertEqual(set(summary), set(["PRG", "EPG", "CIN read", "DCH"]))
+        self.assertEqual(summary["CIN read"]["count"], 11)
+        self.assertEqual(sum(summary["CIN read"]["histogram"]), 11)
+        self.assertEqual(len(summary["DCH"]["histogram"]), len(BUCKETS) + 1)
+
+        seconds, channels, transferred = profiler.throughput()
+        self.assertTrue(seconds > 0)
+        self.assertAlmostEqual(channels * seconds, 12)
+        self.assertIn("CIN read", profiler.report())
+
+    def test_first_byte(self):
+        """
+        First byte is when the first part of the response was received.
+        """
+        scanner = ChunkedScanner(b"MDL,BC125AT\r", 4)
+        scanner.writecommand = scanner.flush = lambda *args: None
+        profiler = scanner.profiler = Profiler()
+        self.assertEqual(scanner.send("MDL"), "MDL,BC125AT")
+
+        record = profiler.records[0]
+        self.assertEqual(scanner.reads, 3)
+        self.assertTrue(record.flushed <= record.first < record.last)
+        self.assertEqual(profiler.throughput()[1:], (0, 16 / record.last))
+
+    def test_empty(self):
+        profiler = Profiler()
+        self.assertEqual(profiler.throughput(), (0, None, None))
+        self.assertEqual(profiler.summary(), {})
+
+    def test_handler(self):
+        """
+        Export reports timings and writes a trace.
+        """
+        filename = os.path.join(self.cachedir, "trace.json")
+        main(["export", "-n", "-b", "2", "--profile-trace", filename])
+        report = sys.stderr.getvalue()
+        self.assertIn("p95 ms", report)
+        self.assertIn("channels/s", report)
+
+        with open(filename) as fh:
+            trace = json.load(fh)
+        self.assertEqual(trace["summary"]["CIN read"]["count"], 50)
+        # PRG, CIN reads and EPG
+        self.assertEqual(len(trace["commands"]), 52)
+        self.assertEqual(set(trace["commands"][0]), set(["command",
+            "response", "write", "written", "flushed", "first", "last"]))
+
+        # Report only
+        with mock.patch("sys.stdin", StringIO(create_csv([51]))):
+            main(["import", "-n", "-b", "2", "--profile"])
+        self.assertIn("CIN write", sys.stderr.getvalue())
+
+    def test_option_order(self):
+        """
+        The profile option does not take the action as a file name.
+        """
+        handler = Handler(["-n", "--profile", "export", "-b", "1"])
+        self.assertEqual(handler.params.command, "export")
+        self.assertTrue(handler.params.profile)
+        self.assertIsNone(handler.params.trace)
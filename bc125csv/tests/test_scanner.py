@@ -1,5 +1,13 @@
 from bc125csv import main
-from bc125csv.scanner import Channel, VirtualScanner, ScannerException
+from bc125csv.scanner import (
+    Channel,
+    ChannelTable,
+    Scanner,
+    ScannerException,
+    VirtualScanner,
+    format_frequency,
+    is_supported_frequency,
+)
 from bc125csv.tests.base import BaseTestCase, mock
 
 class NonRespondingScanner(VirtualScanner):
@@ -14,6 +22,80 @@ class GarbageRespondingScanner(VirtualScanner):
     def writeread(self, command):
         return "GUVFFPNAAREVFZVFORUNIVAT"
 
+class ChunkedScanner(Scanner):
+    """Scanner receiving data in chunks of a fixed size."""
+    def __init__(self, data, size):
+        self.rxbuffer = bytearray()
+        self.chunks = [data[i:i + size] for i in range(0, len(data), size)]
+        self.reads = 0
+
+    @property
+    def in_waiting(self):
+        return len(self.chunks[0]) if self.chunks else 0
+
+    def read(self, size=1):
+        self.reads += 1
+        if not self.chunks:
+            # Timed out
+            return b""
+        chunk = self.chunks.pop(0)
+        self.chunks[:0] = [chunk[size:]] if chunk[size:] else []
+        return chunk[:size]
+
+class RateLimitedScanner(VirtualScanner):
+    """Virtual scanner answering garbage above a baud rate."""
+    def __init__(self, maxrate, leftovers=False):
+        super(RateLimitedScanner, self).__init__()
+        self.maxrate = maxrate
+        self.leftovers = leftovers
+        self.rates = []
+        self.timeouts = []
+
+    def set_rate(self, rate):
+        super(RateLimitedScanner, self).set_rate(rate)
+        self.rates.append(rate)
+        self.timeouts.append(self.timeout)
+
+    def writeread(self, command):
+        if self.rate > self.maxrate:
+            return "\x1e\x7f"
+        if self.leftovers:
+            # Remains of commands sent at a wrong rate
+            self.leftovers = False
+            return "ERR"
+        return super(RateLimitedScanner, self).writeread(command)
+
+class CommandRecordingScanner(VirtualScanner):
+    """Virtual scanner keeping track of the commands sent."""
+    def __init__(self):
+        super(CommandRecordingScanner, self).__init__()
+        self.commands = []
+
+    def writeread(self, command):
+        self.commands.append(command)
+        return super(CommandRecordingScanner, self).writeread(command)
+
+class FlakyScanner(VirtualScanner):
+    """Virtual scanner answering channel commands with errors at first."""
+    def __init__(self, errors=1):
+        super(FlakyScanner, self).__init__()
+        self.errors = errors
+        self.attempts = {}
+
+    def writeread(self, command):
+        self.attempts[command] = self.attempts.get(command, 0) + 1
+        if command[:3] in ("CIN", "DCH") and self.attempts[command] <= self.errors:
+            return "ERR"
+        return super(FlakyScanner, self).writeread(command)
+
+class WindowTrackingScanner(VirtualScanner):
+    """Virtual scanner keeping track of the number of commands in flight."""
+    inflight = 0
+
+    def writecommand(self, command):
+        super(WindowTrackingScanner, self).writecommand(command)
+        self.inflight = max(self.inflight, len(self.responses))
+
 class EnsureChannelDelete:
     def get_channel(self, index):
         return Channel(**{
@@ -43,6 +125,7 @@ class ScannerTestCase(BaseTestCase):
             "priority": False,
         })
         self.assertEqual(str(ch), "CH001: 100.1234 FM")
+        self.assertEqual(ch.frequency, 1001234)
         self.assertEqual(ch.freqcode, "01001234")
         self.assertEqual(ch.tq, "none")
 
@@ -58,6 +141,63 @@ class ScannerTestCase(BaseTestCase):
         ch.tqcode = 148
         self.assertEqual(ch.tq, "DCS 125")
 
+        ch.tqcode = 120
+        self.assertEqual(ch.tq, None)
+
+    def test_channel_equality(self):
+        data = {
+            "index": 1,
+            "name": "Channel name",
+            "frequency": "100.1234",
+            "modulation": "FM",
+            "tqcode": 0,
+            "delay": 2,
+            "lockout": False,
+            "priority": False,
+        }
+        ch = Channel(**data)
+        self.assertEqual(ch, Channel(**data))
+        self.assertNotEqual(ch, None)
+
+        data["name"] = "Other name"
+        self.assertNotEqual(ch, Channel(**data))
+
+    def test_readlinecr(self):
+        scanner = ChunkedScanner(b"MDL,BC125AT\rPRG,OK\rEPG,OK\r", 5)
+        self.assertEqual(scanner.readlinecr(), "MDL,BC125AT")
+        self.assertEqual(scanner.readlinecr(), "PRG,OK")
+        self.assertEqual(scanner.readlinecr(), "EPG,OK")
+        self.assertEqual(scanner.reads, 6)
+        self.assertEqual(scanner.rxbuffer, bytearray())
+
+        # Multiple responses in one read
+        scanner = ChunkedScanner(b"PRG,OK\rEPG,OK\r", 100)
+        self.assertEqual(scanner.readlinecr(), "PRG,OK")
+        self.assertEqual(scanner.readlinecr(), "EPG,OK")
+        self.assertEqual(scanner.reads, 1)
+
+        # Timeout and garbled data
+        with self.assertRaises(ScannerException):
+            scanner.readlinecr()
+        scanner = ChunkedScanner(b"MDL,\xff\xfe\r", 100)
+        with self.assertRaises(ScannerException):
+            scanner.readlinecr()
+
+    def test_probe_rate(self):
+        scanner = RateLimitedScanner(38400)
+        self.assertEqual(scanner.probe_rate(), 38400)
+        self.assertEqual(scanner.rates, [115200, 57600, 38400])
+        self.assertEqual(scanner.rate, 38400)
+
+        # First handshake may fail
+        scanner = RateLimitedScanner(115200, leftovers=True)
+        self.assertEqual(scanner.probe_rate(), 115200)
+        scanner = RateLimitedScanner(115200)
+        self.assertEqual(scanner.probe_rate(rates=(4800, 9600)), 9600)
+
+        with self.assertRaises(ScannerException):
+            RateLimitedScanner(2400).probe_rate()
+
     def test_enter_programming(self):
         scanner = VirtualScanner()
         scanner.enter_programming()
@@ -90,6 +230,22 @@ class ScannerTestCase(BaseTestCase):
             scanner = GarbageRespondingScanner()
             scanner.exit_programming()
 
+    def test_programming(self):
+        scanner = CommandRecordingScanner()
+        with scanner.programming():
+            with scanner.programming():
+                scanner.get_channel(1)
+            scanner.get_channel(2)
+        self.assertEqual(scanner.commands, ["PRG", "CIN,1", "CIN,2", "EPG"])
+        self.assertEqual(scanner.sessions, 0)
+
+        # Programming mode is left on errors
+        with self.assertRaises(ScannerException):
+            with scanner.programming():
+                raise ScannerException("Failed")
+        self.assertEqual(scanner.commands[-2:], ["PRG", "EPG"])
+        self.assertEqual(scanner.sessions, 0)
+
     def test_model(self):
         scanner = VirtualScanner()
         model = scanner.get_model()
@@ -111,6 +267,7 @@ class ScannerTestCase(BaseTestCase):
         scanner = VirtualScanner()
         channel = scanner.get_channel(1)
         self.assertEqual(channel.name, "Channel 1")
+        self.assertEqual(channel.frequency, 1010000)
         self.assertEqual(channel.freqcode, "01010000")
         self.assertEqual(channel.modulation, "FM")
         self.assertEqual(channel.delay, 2)
@@ -177,4 +334,232 @@ class ScannerTestCase(BaseTestCase):
 
         with self.assertRaises(ScannerException):
             scanner = GarbageRespondingDelete()
-            scanner.delete_channel(1)
\ No newline at end of file
+            scanner.delete_channel(1)
+
+    def test_send_many(self):
+        scanner = WindowTrackingScanner()
+        results = scanner.send_many(["MDL", "PRG", "XYZ", "EPG"], window=2)
+        self.assertEqual(results, ["MDL,VIRTUAL", "PRG,OK", None, "EPG,OK"])
+        self.assertEqual(scanner.inflight, 2)
+
+        scanner = WindowTrackingScanner()
+        results = scanner.send_many("CIN,%d" % i for i in range(1, 101))
+        self.assertEqual(len(results), 100)
+        self.assertEqual(scanner.inflight, scanner.WINDOW)
+        self.assertEqual(results[0], "CIN,1,Channel 1,1010000,FM,0,2,0,0")
+
+    def test_channels_get(self):
+        scanner = VirtualScanner()
+        channels = scanner.get_channels(range(18, 22))
+        self.assertEqual([channel and channel.index for channel in channels],
+            [18, 19, None, None])
+
+        with self.assertRaises(ScannerException):
+            scanner = ErrorRespondingScanner()
+            scanner.get_channels(range(1, 4))
+
+        with self.assertRaises(ScannerException):
+            scanner = GarbageRespondingScanner()
+            scanner.get_channels(range(1, 4))
+
+    def test_channels_set(self):
+        channels = [VirtualScanner().get_channel(i) for i in range(1, 4)]
+
+        scanner = VirtualScanner()
+        scanner.set_channels(channels)
+
+        with self.assertRaises(ScannerException):
+            scanner = ErrorRespondingScanner()
+            scanner.set_channels(channels)
+
+    def test_channels_delete(self):
+        scanner = VirtualScanner()
+        with mock.patch.object(scanner, "writecommand",
+                wraps=scanner.writecommand) as writecommand:
+            scanner.delete_channels(range(18, 22))
+
+        # Only channels with data are deleted
+        commands = [args[0] for args, _ in writecommand.call_args_list]
+        self.assertEqual([c for c in commands if c.startswith("DCH,")],
+            ["DCH,18", "DCH,19"])
+
+        class ErrorRespondingDelete(VirtualScanner):
+            def writeread(self, command):
+                if command.startswith("DCH,"):
+                    return "DCH,NG"
+                return super(ErrorRespondingDelete, self).writeread(command)
+
+        with self.assertRaises(ScannerException):
+            scanner = ErrorRespondingDelete()
+            scanner.delete_channels(range(18, 22))
+
+    def test_retry(self):
+        channel = VirtualScanner().get_channel(1)
+
+        # No retries by default
+        with self.assertRaises(ScannerException):
+            FlakyScanner().get_channel(1)
+
+        scanner = FlakyScanner(errors=2)
+        scanner.retries = 3
+        scanner.retry_delay = 0.05
+        with mock.patch("time.sleep") as sleep:
+            self.assertEqual(scanner.get_channel(1), channel)
+            scanner.set_channel(channel)
+            scanner.delete_channel(1)
+            self.assertEqual(scanner.get_channels([2, 3]),
+                VirtualScanner().get_channels([2, 3]))
+            scanner.set_channels([channel])
+            scanner.delete_channels([2, 3])
+        self.assertEqual(scanner.retried, {"CIN": 8, "DCH": 6})
+        self.assertEqual(scanner.retry_budget, scanner.RETRY_BUDGET - 14)
+
+        # Delay doubles on every retry
+        self.assertEqual([args[0] for args, _ in sleep.call_args_list[:2]],
+            [0.05, 0.1])
+
+        # Too many errors for the retries
+        scanner = FlakyScanner(errors=4)
+        scanner.retries = 3
+        scanner.retry_delay = 0.05
+        with mock.patch("time.sleep") as sleep:
+            with self.assertRaises(ScannerException):
+                scanner.get_channel(1)
+        self.assertEqual([args[0] for args, _ in sleep.call_args_list],
+            [0.05, 0.1, 0.2])
+
+        # Budget is used up, and renewed for a programming session
+        scanner = FlakyScanner()
+        scanner.retries = 3
+        scanner.retry_budget = 1
+        with mock.patch("time.sleep"):
+            scanner.get_channel(1)
+            with self.assertRaises(ScannerException):
+                scanner.get_channel(2)
+            with scanner.programming():
+                scanner.get_channel(3)
+
+    def test_channel_state(self):
+        scanner = VirtualScanner()
+        channel = scanner.get_channel(1)
+        scanner.get_channels([20])
+        self.assertEqual(scanner.state, {1: channel, 20: None})
+
+        scanner.delete_channel(1)
+        self.assertEqual(scanner.state[1], None)
+
+        scanner.set_channels([channel])
+        self.assertEqual(scanner.state[1], channel)
+
+        scanner.forget([1])
+        self.assertEqual(scanner.state, {20: None})
+
+        scanner.forget()
+        self.assertEqual(scanner.state, {})
+
+    def test_channel_delete_state(self):
+        scanner = VirtualScanner()
+        scanner.get_channels(range(1, 4))
+
+        # Known channels are not read again
+        with mock.patch.object(scanner, "writeread",
+                wraps=scanner.writeread) as writeread:
+            scanner.delete_channel(1)
+            scanner.delete_channels([2, 3])
+        self.assertEqual([args[0] for args, _ in writeread.call_args_list],
+            ["DCH,1", "DCH,2", "DCH,3"])
+
+        # Known empty channels are not deleted
+        with mock.patch.object(scanner, "writeread",
+                wraps=scanner.writeread) as writeread:
+            scanner.delete_channel(1)
+            scanner.delete_channels([2, 3])
+        self.assertEqual(writeread.call_count, 0)
+
+        # Revalidation reads channels again
+        with mock.patch.object(scanner, "writeread",
+                wraps=scanner.writeread) as writeread:
+            scanner.delete_channel(1, revalidate=True)
+            scanner.delete_channels([2, 3], revalidate=True)
+        self.assertEqual([args[0] for args, _ in writeread.call_args_list],
+            ["CIN,1", "CIN,2", "CIN,3"])
+
+        # Channels changed on the scanner itself are deleted again
+        scanner.memory.clear()
+        with mock.patch.object(scanner, "writeread",
+                wraps=scanner.writeread) as writeread:
+            scanner.delete_channel(1, revalidate=True)
+            scanner.delete_channels([2, 3], revalidate=True)
+        self.assertEqual([args[0] for args, _ in writeread.call_args_list],
+            ["CIN,1", "DCH,1", "CIN,2", "CIN,3", "DCH,2", "DCH,3"])
+
+    def test_channel_table(self):
+        ch1 = Channel(1, "Channel 1", "150.0000")
+        ch51 = Channel(51, "Channel 51", "151.0000")
+        table = ChannelTable({51: ch51, 1: ch1, 2: None})
+
+        self.assertEqual(list(table), [1, 2, 51])
+        self.assertEqual(table.items(), [(1, ch1), (2, None), (51, ch51)])
+        self.assertEqual(table.values(), [ch1, None, ch51])
+        self.assertEqual(len(table), 3)
+        self.assertEqual(table.bank(1), [(1, ch1), (2, None)])
+        self.assertEqual(table.bank(2), [(51, ch51)])
+        self.assertEqual(table.bank(3), [])
+
+        self.assertTrue(2 in table)
+        self.assertFalse(3 in table)
+        self.assertFalse(501 in table)
+        self.assertEqual(table[2], None)
+        self.assertEqual(table.get(3, "default"), "default")
+        for index in (0, 3, 501):
+            with self.assertRaises(KeyError):
+                table[index]
+        with self.assertRaises(KeyError):
+            table[501] = None
+
+        # Copies and comparison
+        other = table.copy()
+        self.assertEqual(table, other)
+        self.assertEqual(table, {1: ch1, 2: None, 51: ch51})
+        self.assertEqual(table.diff(other), [])
+
+        other[2] = Channel(2, "Channel 2", "150.0000")
+        del other[51]
+        other[500] = None
+        self.assertNotEqual(table, other)
+        self.assertEqual(table.diff(other), [2, 51, 500])
+        self.assertEqual(table[2], None)
+
+        self.assertEqual(other.pop(500), None)
+        self.assertEqual(other.pop(500, "default"), "default")
+        with self.assertRaises(KeyError):
+            other.pop(500)
+
+        other.clear()
+        self.assertEqual(len(other), 0)
+        self.assertEqual(repr(other), "ChannelTable({})")
+
+        # Empty tables only equal empty mappings
+        self.assertEqual(other, {})
+        for value in (None, [], 0, ()):
+            self.assertNotEqual(other, value)
+            self.assertFalse(other == value)
+
+    def test_supported_frequency(self):
+        for frequency in (250000, 540000, 1180083, 1180050, 1540875, 1625500,
+                1557525, 1594725, 1740000, 2250000, 4460062, 4460063,
+                5120000):
+            self.assertTrue(is_supported_frequency(frequency), frequency)
+
+        for frequency in (0, 249999, 540050, 1000000, 1500020, 2000000,
+                5120125, 9999999):
+            self.assertFalse(is_supported_frequency(frequency), frequency)
+
+    def test_frequency(self):
+        self.assertEqual(format_frequency(250000), "25.0000")
+        self.assertEqual(format_frequency(4460062), "446.0062")
+
+        for frequency in ("446.0062", "446.00625", "0446.0062"):
+            self.assertEqual(Channel(1, "", frequency).frequency, 4460062)
+        self.assertEqual(Channel(1, "", "446").frequency, 4460000)
+        self.assertEqual(Channel(1, "", 4460000).freqcode, "04460000")
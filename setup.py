@@ -20,7 +20,7 @@ setup(
 	long_description = long_description,
 	author = "Folkert de Vries",
 	author_email = "bc125csv@fdev.nl",
-	packages = ["bc125csv"],
+	packages = ["bc125csv", "bc125csv.benchmarks"],
 	install_requires = ["pyudev", "pyserial"],
 	entry_points="""
 	[console_scripts]